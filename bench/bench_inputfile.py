@@ -0,0 +1,69 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Micro benchmark: the file handling of Axiom0.write, i.e. a new temp file
+per call (fs.reuse_inputfile = False) versus the reused session input file
+in fs.inputdir. Axiom itself is not involved (writeln does nothing), only
+the file system work is measured.
+
+  Usage: python bench/bench_inputfile.py [calls] [bytes]
+"""
+
+
+import os, os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from interfaces.axiom import Axiom0, fs
+
+
+class FileOnly(Axiom0):
+  """
+  Axiom0 which does not talk to Axiom (_writeln is the send hook of
+  writeln and write).
+  """
+  def _writeln(self, src):
+    return True
+
+
+def run(ax, src, n):
+  """
+  Call ax.write(src) n times, return the seconds per call.
+  """
+  t = time.time()
+  for i in xrange(n):
+    ax.write(src)
+  return (time.time() - t) / n
+
+
+def main():
+  n = len(sys.argv) > 1 and int(sys.argv[1]) or 10000
+  size = len(sys.argv) > 2 and int(sys.argv[2]) or 200
+  src = ("x" * 63 + "\n") * (size // 64 + 1)
+
+  old = fs()
+  old.reuse_inputfile = False
+  t_old = run(FileOnly(old), src, n)
+
+  new = fs()
+  ax = FileOnly(new)
+  ax._create_inputfile()
+  t_new = run(ax, src, n)
+  ax.stop()
+
+  print "calls: %i, input: %i bytes, inputdir: %s" % (n, len(src),
+    new.inputdir)
+  print "temp file per call : %8.2f us/call" % (t_old * 1e6)
+  print "reused input file  : %8.2f us/call" % (t_new * 1e6)
+  print "speedup            : %8.2f x" % (t_old / t_new)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+End-to-end latency benchmark of the hot paths, run against the FakeAxiom
+stand-in (bench/fakeaxiom.py), so no Axiom installation is needed:
+  - Axiom0.writeln
+  - Axiom0.write (multiline input via )read)
+  - HTTP POST to wax.py (pool, session lock, Axiom0.write, response)
+For each path p50/p99 latency and the throughput are reported.
+
+  Usage: python bench/bench_latency.py [-n N] [--out-size N] [--tex-size N]
+           [--port PORT]
+"""
+
+
+import os, os.path
+import sys
+import time
+import socket
+import httplib
+import optparse
+import threading
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from interfaces import axiom, pool
+
+
+def fake_appname(opts):
+  """
+  The command line starting the stand-in.
+  """
+  return "%s %s --out-size %i --tex-size %i" % (sys.executable,
+    os.path.join(ROOT, 'bench', 'fakeaxiom.py'), opts.out_size, opts.tex_size)
+
+
+def percentile(data, p):
+  """
+  The p-th percentile (0..100) of the sorted list data.
+  """
+  k = int(round((len(data) - 1) * p / 100.0))
+  return data[k]
+
+
+def measure(name, fn, n):
+  """
+  Call fn() n times and print p50, p99 (ms) and the calls per second.
+  """
+  times = []
+  total = time.time()
+  for i in xrange(n):
+    t = time.time()
+    fn()
+    times.append(time.time() - t)
+  total = time.time() - total
+  times.sort()
+  print "%-10s %8i %10.3f %10.3f %10.1f" % (name, n,
+    percentile(times, 50) * 1e3, percentile(times, 99) * 1e3, n / total)
+
+
+def bench_axiom0(opts):
+  cfg = axiom.fs()
+  cfg.appname = fake_appname(opts)
+  cfg.cmd_init = [")set output tex on"]
+  ax = axiom.Axiom0(cfg)
+  if not ax.start():
+    print "Could not start the stand-in."
+    return
+  measure("writeln", lambda: ax.writeln("integrate(x^2,x)"), opts.n)
+  measure("write", lambda: ax.write("f(x) == x^2\nf(3)\n"), opts.n)
+  ax.stop()
+
+
+def bench_http(opts):
+  pool.fs.axiom_cfg.appname = fake_appname(opts)
+  pool.fs.axiom_cfg.cmd_init = [")set output tex on"]
+  os.chdir(ROOT) # templates
+  import web
+  import wax
+  app = web.application(wax.urls, vars(wax))
+  server = web.httpserver.WSGIServer(('127.0.0.1', opts.port),
+    app.wsgifunc())
+  t = threading.Thread(target = server.start)
+  t.daemon = True
+  t.start()
+  time.sleep(1)
+
+  # No Nagle: headers and body are sent separately by httplib
+  conn = httplib.HTTPConnection('127.0.0.1', opts.port)
+  conn.connect()
+  conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+  cookie = {}
+  def post():
+    headers = {'Content-Type':'text/plain'}
+    if cookie: headers['Cookie'] = cookie['v']
+    conn.request('POST', '/', "integrate(x^2,x)", headers)
+    r = conn.getresponse()
+    r.read()
+    if r.getheader('set-cookie'):
+      cookie['v'] = r.getheader('set-cookie').split(';')[0]
+  post() # session setup
+  measure("http POST", post, opts.n)
+  conn.close()
+  server.stop()
+  wax.pool.stop()
+
+
+def main():
+  p = optparse.OptionParser()
+  p.add_option('-n', type = 'int', default = 500)
+  p.add_option('--out-size', type = 'int', default = 200)
+  p.add_option('--tex-size', type = 'int', default = 200)
+  p.add_option('--port', type = 'int', default = 8099)
+  opts, args = p.parse_args()
+  print "output: %i bytes, TeX: %i bytes" % (opts.out_size, opts.tex_size)
+  print "%-10s %8s %10s %10s %10s" % ("path", "calls", "p50 ms", "p99 ms",
+    "calls/s")
+  bench_axiom0(opts)
+  bench_http(opts)
+
+
+if __name__ == '__main__':
+  main()
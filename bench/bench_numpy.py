@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Benchmark: transfer of a Matrix DoubleFloat into a NumPy array, either
+by scraping the 2-D text output (read from a pty with PtyReader, then
+axnum.scrape) or as Axiom's InputForm in a data file (axnum.loads). Axiom
+is not required: the output is written by cat and the data file by this
+script, i.e. the time Axiom needs to print or write the value is not
+included. Requires NumPy.
+
+  Usage: python bench/bench_numpy.py [elements ...]
+"""
+
+
+import os, os.path
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pexpect
+from interfaces import axnum
+from interfaces.axiom import PtyReader, fs
+
+
+def make_matrix(n):
+  """
+  A square list of lists with about n random floats.
+  """
+  k = max(1, int(round(n ** 0.5)))
+  return [[random.uniform(-1e3, 1e3) for j in range(k)] for i in range(k)]
+
+
+def text_output(m):
+  """
+  The matrix m as in Axiom's 2-D output.
+  """
+  rows = ["        |" + "  ".join(map(repr, r)) + "|" for r in m]
+  rows[len(rows) // 2] = "   (1)  " + rows[len(rows) // 2].lstrip()
+  return "\n" + "\n".join(rows) + "\n" + \
+    ("Type: Matrix(DoubleFloat)").rjust(60) + "\n"
+
+
+def inputform(m):
+  """
+  The matrix m as unparse(convert(m)@InputForm).
+  """
+  return "matrix([" + ",".join(["[" + ",".join(map(repr, r)) + "]"
+    for r in m]) + "])\n"
+
+
+def write_tmp(data, suffix, dir = None):
+  f = tempfile.NamedTemporaryFile(suffix = suffix, dir = dir, delete = False)
+  f.write(data)
+  f.close()
+  return f.name
+
+
+def run_scrape(fname):
+  p = pexpect.spawn('/bin/sh', ['-c',
+    'cat %s; printf "(2) -> "; sleep 5' % fname], timeout = 300)
+  rd = PtyReader(p.child_fd, fs.prompt_re, fs.prompt_maxlen, fs.maxread)
+  t = time.time()
+  rd.expect(300)
+  a = axnum.scrape(rd.before.tobytes())
+  t = time.time() - t
+  p.close()
+  return t, a
+
+
+def run_file(fname):
+  t = time.time()
+  f = open(fname, 'rb')
+  a = axnum.loads(f.read())
+  f.close()
+  return time.time() - t, a
+
+
+def main():
+  sizes = map(int, map(float, sys.argv[1:])) or [10**4, 10**5, 10**6]
+  print "%10s %12s %12s %12s %8s" % ("elements", "scrape s", "file s",
+    "speedup", "equal")
+  for n in sizes:
+    m = make_matrix(n)
+    f0 = write_tmp(text_output(m), '.out')
+    f1 = write_tmp(inputform(m), axnum.fs.data_suffix, axnum.fs.datadir)
+    try:
+      t0, a0 = run_scrape(f0)
+      t1, a1 = run_file(f1)
+    finally:
+      os.unlink(f0)
+      os.unlink(f1)
+    print "%10i %12.3f %12.3f %12.1f %8s" % (a1.size, t0, t1, t0 / t1,
+      a0.shape == a1.shape and (a0 == a1).all())
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,87 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Benchmark: processing a large Axiom output (text, TeX fragments with
+\\sp, \\sb, \\root and \\leqno, Type lines) with the former regex chain of
+tm_axiom.processOutput versus the single pass axparse.tm.parse. The
+results of both are compared.
+
+  Usage: python bench/bench_parse.py [MB ...]
+"""
+
+
+import os, os.path
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from interfaces import axparse
+
+
+def make_output(size):
+  """
+  About size bytes of Axiom like output (algebra and TeX per result).
+  """
+  row = " ".join(["%9.6f" % (i * 0.37) for i in range(7)])
+  parts = []
+  n = 0
+  i = 1
+  while n < size:
+    s = ("\n   (%i)  %s\n   %s\n$$\n{x \\sp %i} \\sb {k} + \\root {3} \\of "
+      "{y \\sp 2} + %s\n\\leqno(%i)\n$$\n%s\n") % (i, row, row, i, row, i,
+      ("Type: Expression(Integer)").rjust(60))
+    parts.append(s)
+    n += len(s)
+    i += 1
+  return "".join(parts)
+
+
+def process_old(data):
+  """
+  tm_axiom.processOutput before axparse.
+  """
+  tex = re.findall('\$\$[^\$]*\$\$', data)
+  txt = data
+  for s in tex:
+    txt = txt.replace(s,'')
+  tex = map(lambda t: re.sub(r"\\leqno\(\d*\)", "", t), tex)
+  tex = map(lambda t: re.sub(r"\\sp\s*([^ \t\r\n\f\v\\]*)", r"^{\1}", t), tex)
+  tex = map(lambda t: re.sub(r"\\sb\s*([^ \t\r\n\f\v\\]*)", r"_{\1}", t), tex)
+  tex = map(lambda t: re.sub(r"\\root\s*(\{\d*\})\s*\\of", r"\\sqrt[\1]", t), tex)
+  ty = re.findall('Type:[a-zA-Z0-9_. ]*', data)
+  ty = map(lambda x: x.replace('Type:','').strip(), ty)
+  return txt, tex, ty
+
+
+def process_new(data):
+  p = axparse.tm.parse(data)
+  return p.txt(), p.tex, p.types
+
+
+def timed(fn, data):
+  t = time.time()
+  r = fn(data)
+  return time.time() - t, r
+
+
+def main():
+  sizes = map(float, sys.argv[1:]) or [0.25, 1, 2, 4]
+  print "%8s %10s %12s %12s %12s %8s" % ("MB", "fragments", "old s",
+    "axparse s", "speedup", "equal")
+  for mb in sizes:
+    data = make_output(int(mb * 2**20))
+    t0, r0 = timed(process_old, data)
+    t1, r1 = timed(process_new, data)
+    print "%8.2f %10i %12.3f %12.3f %12.1f %8s" % (mb, len(r1[1]), t0, t1,
+      t0 / t1, r0 == r1)
+
+
+if __name__ == '__main__':
+  main()
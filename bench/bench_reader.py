@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Benchmark: reading a large output followed by the prompt from a pty with
+pexpect's expect versus PtyReader.expect. The "output" is a file written
+by cat (Axiom is not required), followed by a prompt '(1) ->'.
+
+  Usage: python bench/bench_reader.py [MB ...]
+"""
+
+
+import os, os.path
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pexpect
+from interfaces.axiom import PtyReader, fs
+
+
+def make_output(size):
+  """
+  Write size bytes of matrix like lines to a temp file, return its name.
+  """
+  line = " ".join(["%9.6f" % (i * 0.37) for i in range(7)]) + "\n"
+  f = tempfile.NamedTemporaryFile(suffix = '.out', delete = False)
+  f.write(line * (size // len(line) + 1))
+  f.close()
+  return f.name
+
+
+def child(fname):
+  return pexpect.spawn('/bin/sh', ['-c',
+    'cat %s; printf "(1) -> "; sleep 5' % fname], timeout = 300)
+
+
+def run_pexpect(fname):
+  p = child(fname)
+  t = time.time()
+  p.expect([fs.prompt_re, pexpect.EOF, pexpect.TIMEOUT])
+  t = time.time() - t
+  n = len(p.before)
+  p.close()
+  return t, n
+
+
+def run_reader(fname):
+  p = child(fname)
+  rd = PtyReader(p.child_fd, fs.prompt_re, fs.prompt_maxlen, fs.maxread)
+  t = time.time()
+  rd.expect(300)
+  t = time.time() - t
+  n = len(rd.before)
+  p.close()
+  return t, n
+
+
+def main():
+  sizes = map(float, sys.argv[1:]) or [0.5, 1, 2, 4]
+  print "%8s %12s %12s %12s %12s" % ("MB", "pexpect s", "ns/byte",
+    "PtyReader s", "ns/byte")
+  for mb in sizes:
+    fname = make_output(int(mb * 2**20))
+    try:
+      t0, n0 = run_pexpect(fname)
+      t1, n1 = run_reader(fname)
+    finally:
+      os.unlink(fname)
+    print "%8.2f %12.3f %12.1f %12.3f %12.1f" % (mb, t0, t0 / n0 * 1e9,
+      t1, t1 / n1 * 1e9)
+
+
+if __name__ == '__main__':
+  main()
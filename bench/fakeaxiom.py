@@ -0,0 +1,177 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+A scripted stand-in for the Axiom console, good enough to drive Axiom0,
+AsyncAxiom and wax.py without an Axiom installation (benchmarks, demos).
+
+It speaks the '(n) ->' prompt protocol and understands:
+  )read "file" [)quiet]         evaluate the lines of the file
+  )set output tex on|off        emit TeX ($$ ... \leqno(n) $$) per result
+  )set output algebra on|off    emit the 2-D text per result
+  )lisp (... (princ "text") ...) print text (used by Axiom0.write_batch)
+  )quit                         terminate
+  sleep(seconds)                wait (e.g. to test interrupts)
+  x := expr, f(x) == expr       definitions
+  expr;                         no output
+Everything else is echoed as the "value" of the step. Ctrl-C aborts the
+current command like Axiom does.
+
+  Usage: python bench/fakeaxiom.py [--out-size N] [--tex-size N]
+           [--delay SECONDS] [--banner-delay SECONDS]
+  --out-size/--tex-size pad each text/TeX result to N bytes.
+"""
+
+
+import re
+import sys
+import time
+import optparse
+
+
+BANNER = """                        FakeAxiom (wax stand-in)
+                 Issue )quit to leave the (fake) session.
+"""
+
+
+class FakeAxiom():
+  """
+  The interpreter state: step number and output settings.
+  """
+
+  def __init__(self, opts):
+    self.opts = opts
+    self.step = 1
+    self.tex = False
+    self.algebra = True
+    self.out = sys.stdout
+
+
+  def write(self, s):
+    self.out.write(s)
+    self.out.flush()
+
+
+  def pad(self, s, n):
+    """
+    Pad s with a matrix like row pattern to (at least) n bytes.
+    """
+    if len(s) >= n: return s
+    row = " ".join(["%9.6f" % (i * 0.37) for i in range(7)])
+    lines = [s]
+    size = len(s)
+    while size < n:
+      lines.append("   " + row)
+      size += len(row) + 4
+    return "\n".join(lines)
+
+
+  def result(self, value, typ):
+    """
+    Print a result as Axiom does, advance the step number.
+    """
+    out = ["\n"]
+    if self.algebra:
+      out.append("   (%i)  %s\n" % (self.step,
+        self.pad(value, self.opts.out_size)))
+    if self.tex:
+      tex = self.pad(r"\mbox{\tt %s}" % value, self.opts.tex_size)
+      out.append("$$\n%s\n\\leqno(%i)\n$$\n" % (tex, self.step))
+    out.append(("Type: %s" % typ).rjust(60) + "\n")
+    self.write("".join(out))
+    self.step += 1
+
+
+  def system(self, cmd):
+    """
+    System commands.
+    """
+    words = cmd[1:].split()
+    if not words: return True
+    if words[0] == 'quit': return False
+    if words[0] == 'read' and len(words) > 1:
+      self.read(words[1].strip('"'))
+    elif words[0] == 'set' and words[1:3] in (['output', 'tex'],
+      ['output', 'algebra']):
+      flag = len(words) > 3 and words[3] == 'on'
+      if words[2] == 'tex':
+        self.tex = flag
+      else:
+        self.algebra = flag
+    elif words[0] == 'lisp':
+      m = re.search(r'princ\s+"([^"]*)"', cmd)
+      self.write("%s\nValue = NIL\n" % (m and m.group(1) or ""))
+    return True
+
+
+  def read(self, filename):
+    """
+    Evaluate a file; indented lines continue the previous command.
+    """
+    try:
+      f = open(filename)
+    except IOError:
+      self.write("\n   The file %s is needed but does not exist.\n" % filename)
+      return
+    cmds = []
+    for line in f.read().splitlines():
+      if cmds and line[:1] in (' ', '\t') and line.strip():
+        cmds[-1] += " " + line.strip()
+      else:
+        cmds.append(line)
+    f.close()
+    for cmd in cmds:
+      self.eval(cmd)
+
+
+  def eval(self, cmd):
+    """
+    Evaluate one command (line). Return False on )quit.
+    """
+    cmd = cmd.strip()
+    if not cmd: return True
+    if cmd.startswith(')'): return self.system(cmd)
+    time.sleep(self.opts.delay)
+    m = re.match(r"sleep\(([0-9.]+)\)", cmd)
+    if m:
+      time.sleep(float(m.group(1)))
+    if cmd.endswith(';'):
+      self.step += 1
+    elif '==' in cmd:
+      self.write("%s\n" % ("Type: Void").rjust(60))
+      self.step += 1
+    elif ':=' in cmd:
+      self.result(cmd.split(':=', 1)[1].strip(), "PositiveInteger")
+    else:
+      self.result(cmd, "PositiveInteger")
+    return True
+
+
+  def loop(self):
+    time.sleep(self.opts.banner_delay)
+    self.write(BANNER)
+    while True:
+      self.write("(%i) -> " % self.step)
+      try:
+        line = sys.stdin.readline()
+        if not line: break
+        if not self.eval(line): break
+      except KeyboardInterrupt:
+        self.write("\n   >> System error:\n   Console interrupt.\n\n")
+
+
+def main():
+  p = optparse.OptionParser()
+  p.add_option('--out-size', type = 'int', default = 0)
+  p.add_option('--tex-size', type = 'int', default = 0)
+  p.add_option('--delay', type = 'float', default = 0.0)
+  p.add_option('--banner-delay', type = 'float', default = 0.0)
+  opts, args = p.parse_args()
+  FakeAxiom(opts).loop()
+
+if __name__ == '__main__':
+  main()
@@ -31,6 +31,7 @@ import tempfile
 import os, os.path
 import termcolor
 import app_latex
+import axparse
 
 if os.name == 'nt':
   import winpexpect as xp
@@ -56,9 +57,14 @@ fs.cmd_read_tpl = ")read %s"  #no crlf !!
 fs.cmd_read_quiet_tpl = ")read %s )quiet"
 fs.in_prefix = 'scios$oax_'
 fs.in_suffix = '.input'
+if os.path.isdir('/dev/shm'):
+  fs.in_dir = '/dev/shm'  # block mode input file (RAM-backed if possible)
+else:
+  fs.in_dir = None
 fs.prompt_re = "\([0-9]+\) ->"
 fs.use_tex = False
 fs.use_breqn = True
+fs.tex_batch = False  # one image per result (tex_objs), single latex run
 fs.mode = 0
 fs.err_tpl_start = "Error: Axiom start: %s"
 fs.err_tpl_block = "Error: Block input: %s"
@@ -107,6 +113,9 @@ class Axiom():
     # TeX instance
     self.tex_obj = None
 
+    # TeX instances, one per result (tex_batch mode)
+    self.tex_objs = None
+
     # Cmd templates to read in a file (within axiom)
     self.cmd_read_tpl = cfg.cmd_read_tpl
     self.cmd_read_quiet_tpl = cfg.cmd_read_quiet_tpl
@@ -117,6 +126,9 @@ class Axiom():
     # Suffix for temp input files (block mode)
     self.in_suffix = cfg.in_suffix
 
+    # Input file (block mode), created once and reused
+    self.in_file = None
+
     # Regular expression for prompt
     self.prompt_re = cfg.prompt_re
 
@@ -176,6 +188,12 @@ class Axiom():
     if self.p is not None:
       self.p.close()
       self.p = None
+    if self.in_file is not None:
+      try:
+        os.remove(self.in_file)
+      except OSError:
+        pass
+      self.in_file = None
 
 
   def isalive(self):
@@ -206,13 +224,17 @@ class Axiom():
     """
     Input in block mode, i.e. as if a input file is read in (what is
     actually done). Output is (unmodified) stored in 'output'.
+    The input file is created on first use and overwritten afterwards.
     """
-    input_file = tempfile.NamedTemporaryFile(prefix = self.in_prefix,
-      suffix = self.in_suffix, delete = False)
+    if self.in_file is None:
+      fd, self.in_file = tempfile.mkstemp(self.in_suffix, self.in_prefix,
+        self.cfg.in_dir)
+      os.close(fd)
+    input_file = open(self.in_file, 'w')
     input_file.write(src)
     input_file.close()
 
-    cmd = self.cmd_read_quiet_tpl % input_file.name
+    cmd = self.cmd_read_quiet_tpl % self.in_file
 
     n = self.p.sendline(cmd)
     i = self.p.expect([self.prompt_re, xp.EOF, xp.TIMEOUT])
@@ -258,29 +280,21 @@ class Axiom():
     """
     if output is None: output = self.output
 
-    r = output.strip(" \n").split("Type:")
-    ri = re.match("^\(([0-9]+)\)", r[0]).group(1)
-    rv = re.split("^\([0-9]+\)",r[0])[1].strip(" \n")
-    rv = re.sub("_\n","", rv)
-    rt = r[1].strip()
-    return ri, rt, rv
+    return axparse.type_and_value(output)
 
 
   def extract_types(self, data):
     """
     Extract the type(s) returned
     """
-    ty = re.findall('Type:[a-zA-Z0-9_. ]*', data)
-    ty = map(lambda x: x.replace('Type:',''), ty)
-    return map(lambda x: x.strip(), ty)
+    return axparse.plain.parse(data).types
 
 
   def extract_tex(self, data):
     """
     Extract TeX code from data
     """
-    tex = re.findall('\$\$[^\$]*\$\$', data)
-    return tex
+    return axparse.plain.parse(data).tex
 
 
   def remove_tex(self, data):
@@ -333,19 +347,25 @@ class Axiom():
       return False
 
 
+    # Types, TeX fragments (breqn) and text in one pass
+    if self.use_tex and self.use_breqn:
+      parsed = axparse.breqn.parse(self.output)
+    else:
+      parsed = axparse.plain.parse(self.output)
+
     # Get the type(s) returned
-    self.types = self.extract_types(self.output)
+    self.types = parsed.types
 
     # TeX processing (return if use_tex = False)
     if not self.use_tex: return False
 
-    self.tex = self.extract_tex(self.output)
-    self.txt = self.split_tex(self.output)
+    self.tex = parsed.tex
+    self.txt = parsed.text
 
     # TeX output
-    if self.use_breqn:
-      self.tex = map(self.tex_breqn, self.tex)
-    if self.tex != []:
+    if self.cfg.tex_batch and len(self.tex) > 1:
+      self.tex_objs = app_latex.tex_batch(self.tex)
+    elif self.tex != []:
       self.tex_obj = app_latex.TeX("\n".join(self.tex))
 
 
@@ -471,6 +491,7 @@ class Axiom():
     """
     self.png = None
     self.tex_obj = None
+    self.tex_objs = None
     self.txt = None
     self.tex = None
     if self.mode == 0:
@@ -488,6 +509,8 @@ class Axiom():
     if self.use_tex:
       if self.tex == []:
         print self.last_output
+      elif self.tex_objs is not None:
+        return self.tex_objs
       else:
         return self.tex_obj
 
@@ -28,8 +28,13 @@ Module app_latex:
 import re
 import subprocess
 import os, os.path
+import time
+import shutil
 from shutil import move
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp, gettempdir
+import texcache
+import texfmt
+import texstats
 
 
 pipe = subprocess.PIPE
@@ -43,6 +48,8 @@ fs.__doc__ = """app_latex factory settings"""
 fs.latex = 'latex'
 fs.pdflatex = 'pdflatex'
 fs.dvipng = 'dvipng'
+fs.dvisvgm = 'dvisvgm'
+fs.backend = 'png' # or 'svg' (dvisvgm, resolution independent)
 fs.breqn = True
 fs.pt = 10
 fs.D = 120
@@ -71,56 +78,116 @@ if fs.breqn: fs.preamble = fs.preamble_breqn
 
 fs.opt = None
 fs.opt_tpl = "-T %s -D %i -bg %s -fg %s -O %s -bd %s"
-fs.suffixes = ['.tex', '.dvi', '.log', '.aux', '.png', '.pdf']
+fs.suffixes = ['.tex', '.dvi', '.log', '.aux', '.png', '.pdf', '.svg']
 fs.keepfiles = False
 fs.outdir = None
 
+# All temporary files and workspaces are created in tmpdir (RAM-backed if
+# possible, None: system temp dir) with the prefix tmp_prefix.
+if os.path.isdir('/dev/shm'):
+  fs.tmpdir = '/dev/shm'
+else:
+  fs.tmpdir = None
+fs.tmp_prefix = 'app_latex_'
+
 fs.latex_cmd_tpl = "%s -halt-on-error -output-directory=%s %s"
+fs.latex_fmt_cmd_tpl = "%s -halt-on-error -fmt=%s -output-directory=%s %s"
+
+# Run latex with a precompiled format (texfmt) for the preamble.
+fs.use_fmt = True
 fs.dvipng_cmd_tpl = "%s %s -o %s %s"
 
+# dvisvgm: glyphs as paths defined once and referenced (-n), exact
+# bounding box (-e), relative path commands (-R) with 3 digits (-d 3),
+# optimized (-O); pages, output file (%p: page number), dvi file.
+fs.dvisvgm_cmd_tpl = "%s -n -e -R -d 3 -O -p %s -o %s %s"
+
 fs.repr_png = True
 
+# Batch mode (tex2png_batch): one page per source. The empty box keeps
+# pages without output, so that page n is source n.
+fs.batch_page = "\\null\n%s\n\\clearpage\n"
+
+# Cache of rendered images (texcache.PNGCache) or None (always render).
+fs.cache = texcache.cache
+
+# Concurrent renders of the same image run once (texcache.SingleFlight)
+# or None.
+fs.flights = texcache.flights
+
 #;;;;;;;;;;;;;;
 # Functions ;;;
 #;;;;;;;;;;;;;;
 
-def latex(src, cfg):
+def tmpfile(suffix, cfg, ws = None):
+  """
+  Create a named temporary file in the workspace ws or cfg.tmpdir.
+  Return: the open file.
+  """
+  if ws is not None:
+    tmpdir = ws.path
+  else:
+    tmpdir = cfg.tmpdir
+  return NamedTemporaryFile(suffix = suffix, prefix = cfg.tmp_prefix,
+    dir = tmpdir, delete = False)
+
+
+def latex(src, cfg, ws = None):
   """
   Write the TeX source to a temporary file then run latex with the file as
-  input. All output goes into the system temp directory.
+  input. All output goes into cfg.tmpdir (or the workspace ws).
   Return: Popen return code, stdout, stderr, temp file name.
   """
   # Create a named temporary file for the TeX source code
-  texfile = NamedTemporaryFile(suffix = ".tex", delete = False)
+  texfile = tmpfile(".tex", cfg, ws)
 
   # Create the TeX source (template % (font_size, tex_string)
   texinput = cfg.preamble % (cfg.pt, src)
 
+  # Precompiled preamble: only the body is written
+  fmt = None
+  if cfg.use_fmt:
+    header, body = texfmt.split(texinput)
+    if header is not None:
+      fmt = texfmt.get(header, cfg.latex)
+
   # Write TeX input to temp file and close it
-  texfile.write(texinput)
+  texfile.write(fmt is None and texinput or body)
   texfile.close()
 
   # LaTeX process
-  cmd_tpl = cfg.latex_cmd_tpl
   if cfg.outdir is None:
     outdir = os.path.dirname(texfile.name)
-  cmd = cmd_tpl % (cfg.latex, outdir, texfile.name)
+  if fmt is None:
+    cmd = cfg.latex_cmd_tpl % (cfg.latex, outdir, texfile.name)
+  else:
+    cmd = cfg.latex_fmt_cmd_tpl % (cfg.latex, fmt, outdir, texfile.name)
   p = subprocess.Popen(cmd, shell = True, stdout = pipe, stderr = pipe)
 
   # Run (returns stdout/stderr)
   outlog, errlog = p.communicate()
 
+  # Format rejected (e.g. after a TeX update): discard it, run once more
+  # with the whole document
+  if p.returncode != 0 and fmt is not None and texfmt.rejected(fmt, outlog):
+    f = open(texfile.name, 'w')
+    f.write(texinput)
+    f.close()
+    cmd = cfg.latex_cmd_tpl % (cfg.latex, outdir, texfile.name)
+    p = subprocess.Popen(cmd, shell = True, stdout = pipe, stderr = pipe)
+    outlog, errlog = p.communicate()
+
   return p.returncode, outlog, errlog, texfile.name
 
 
-def pdflatex(src, cfg):
+def pdflatex(src, cfg, ws = None):
   """
   Write the TeX source to a temporary file then run pdflatex with the file as
-  input. All output goes into the system temp directory.
+  input. All output goes into cfg.tmpdir (or the workspace ws).
   Return: Popen return code, stdout, stderr, pdf file name.
   """
   # Create a named temporary file for the TeX source code
-  texfile = NamedTemporaryFile(suffix = ".tex", delete = False)
+  texfile = tmpfile(".tex", cfg, ws)
 
   # Create the TeX source (template % (font_size, tex_string)
   texinput = cfg.preamble % (cfg.pt, src)
@@ -163,19 +230,54 @@ def dvipng(dvifile, cfg):
   return p.returncode, outlog, errlog, pngfile
 
 
+def dvisvgm(dvifile, cfg):
+  """
+  Create an SVG image by running dvisvgm on the dvi file (dvifile), in
+  the color cfg.fg (see texcache.colorize).
+  Return: Popen returncode, stdout, stderr, svg file name.
+  """
+  root, ext = os.path.splitext(dvifile)
+  svgfile = root + ".svg"
+
+  cmd = cfg.dvisvgm_cmd_tpl % (cfg.dvisvgm, "1", svgfile, dvifile)
+  p = subprocess.Popen(cmd, shell = True, stdout = pipe, stderr = pipe)
+
+  # Run (returns stdout/stderr)
+  outlog, errlog = p.communicate()
+
+  svg = p.returncode == 0 and read_file(svgfile)
+  if svg:
+    f = open(svgfile, 'wb')
+    f.write(texcache.colorize(svg, cfg.fg))
+    f.close()
+
+  return p.returncode, outlog, errlog, svgfile
+
+
+def dvi2img(dvifile, cfg):
+  """
+  Run dvipng or dvisvgm (cfg.backend) on the dvi file.
+  Return: Popen returncode, stdout, stderr, image file name.
+  """
+  if cfg.backend == 'svg':
+    return dvisvgm(dvifile, cfg)
+  return dvipng(dvifile, cfg)
+
+
 def cleanup(path, cfg):
   """
   Remove all (by this instance) produced temp files with suffixes defined in
-  cfg.suffixes. Return True or False.
+  cfg.suffixes; missing files are skipped. Return True if none is left.
   """
   # Cleanup (leave no traces in temp dir)
   if cfg.keepfiles: return True
-  suffixes = cfg.suffixes
-  try:
-    for s in suffixes: os.remove(path + s)
-    return True
-  except:
-    return False
+  ok = True
+  for s in cfg.suffixes:
+    try:
+      os.remove(path + s)
+    except OSError:
+      if os.path.exists(path + s): ok = False
+  return ok
 
 
 def get_fileparts(f):
@@ -194,21 +296,270 @@ def get_fileparts(f):
   return head, tail, root, ext
 
 
+def cache_key(src, cfg):
+  """
+  The texcache key of src: the source and every setting the image
+  depends on.
+  """
+  if cfg.backend == 'svg':
+    return texcache.key('app_latex', cfg.preamble, cfg.pt, src, cfg.latex,
+      cfg.backend, cfg.dvisvgm, cfg.dvisvgm_cmd_tpl, cfg.fg)
+  opt = cfg.opt
+  if opt is None:
+    opt = cfg.opt_tpl % (cfg.T, cfg.D, cfg.bg, cfg.fg, cfg.O, cfg.bd)
+  return texcache.key('app_latex', cfg.preamble, cfg.pt, src, cfg.latex,
+    cfg.dvipng, opt)
+
+
+def read_file(filename):
+  """
+  Return the contents of the (PNG, SVG, PDF) file (None if it cannot be
+  read).
+  """
+  try:
+    f = open(filename, 'rb')
+    data = f.read()
+    f.close()
+    return data
+  except IOError:
+    return None
+
+
+def write_png(png, cfg, suffix = ".png"):
+  """
+  Write the PNG (or SVG) image to a new temporary file.
+  Return: the name of the file.
+  """
+  pngfile = tmpfile(suffix, cfg)
+  pngfile.write(png)
+  pngfile.close()
+  return pngfile.name
+
+
 def tex2png(src, cfg):
   """
-  Create a TeX rendered PNG image from the TeX source string src.
+  Create a TeX rendered PNG image from the TeX source string src (SVG if
+  cfg.backend = 'svg'). Cached images and images rendered by another
+  thread at the same time are written to a new temporary file.
   Return: the name of the PNG file as string.
   """
-  r, out, err, fname = latex(src, cfg)
-  if r != 0:
-    return False
-  root, ext = os.path.splitext(fname)
-  dvifile = root + '.dvi'
-  r, out, err, pngfile = dvipng(dvifile, cfg)
-  if r != 0:
-    return False
+  key = cache_key(src, cfg)
+  if cfg.cache is not None:
+    png = cfg.cache.get(key, cfg.backend)
+    if png is not None:
+      return write_png(png, cfg, "." + cfg.backend)
+  if cfg.flights is None:
+    return _tex2png(src, key, cfg)
+  result = {}
+  def run():
+    result['pngfile'] = _tex2png(src, key, cfg)
+    return result['pngfile'] and read_file(result['pngfile'])
+  png = cfg.flights.do(key, run)
+  if 'pngfile' in result: return result['pngfile']
+  if not png: return False
+  return write_png(png, cfg, "." + cfg.backend)
+
+
+def _tex2png(src, key, cfg):
+  """
+  Run latex and dvipng (dvisvgm) on src in a workspace, store the image in
+  cfg.cache. Only the image is left, in a new temporary file.
+  Return: the name of the PNG file or False.
+  """
+  ws = Workspace(cfg)
+  try:
+    r, out, err, fname = latex(src, cfg, ws)
+    if r != 0: return False
+    root, ext = os.path.splitext(fname)
+    r, out, err, imgfile = dvi2img(root + '.dvi', cfg)
+    if r != 0: return False
+    png = ws.read(imgfile)
+    if png is None: return False
+  finally:
+    if not cfg.keepfiles: ws.remove()
+  if cfg.cache is not None:
+    cfg.cache.put(key, png, cfg.backend)
+  return write_png(png, cfg, "." + cfg.backend)
+
+
+def dvipng_pages(dvifile, n, cfg):
+  """
+  Create one PNG image per page of the dvi file (n pages) with a single
+  dvipng run (SVG, dvisvgm if cfg.backend = 'svg'). The page files are
+  removed.
+  Return: the list of images or None on errors.
+  """
+  root, ext = os.path.splitext(dvifile)
+
+  if cfg.backend == 'svg':
+    pngfile = root + "%d.svg"
+    cmd = cfg.dvisvgm_cmd_tpl % (cfg.dvisvgm, "1-", root + "%p.svg", dvifile)
   else:
-    return pngfile
+    pngfile = root + "%d.png"
+    if cfg.opt == None:
+      cfg.opt = cfg.opt_tpl % (cfg.T, cfg.D, cfg.bg, cfg.fg, cfg.O, cfg.bd)
+    cmd = cfg.dvipng_cmd_tpl % (cfg.dvipng, cfg.opt, pngfile, dvifile)
+  p = subprocess.Popen(cmd, shell = True, stdout = pipe, stderr = pipe)
+  p.communicate()
+
+  pngs = [read_file(pngfile % (i + 1)) for i in range(n)]
+  for i in range(n):
+    if os.path.exists(pngfile % (i + 1)): os.remove(pngfile % (i + 1))
+  if p.returncode != 0 or None in pngs:
+    return None
+  if cfg.backend == 'svg':
+    pngs = [texcache.colorize(svg, cfg.fg) for svg in pngs]
+  return pngs
+
+
+def tex2png_batch(srcs, cfg):
+  """
+  Create the PNG (SVG) images of all TeX source strings in the list srcs
+  with a single latex and dvipng (dvisvgm) run, one page per source. Cached and repeated
+  sources are rendered only once. If the batch fails (e.g. a source has
+  errors) the sources are rendered one by one.
+  Return: the list of PNG images (None where rendering failed).
+  """
+  keys = [cache_key(src, cfg) for src in srcs]
+  found = {}
+  todo = []
+  for k, src in zip(keys, srcs):
+    if k in found: continue
+    found[k] = None
+    if cfg.cache is not None: found[k] = cfg.cache.get(k, cfg.backend)
+    if found[k] is None: todo.append((k, src))
+  if not todo: return [found[k] for k in keys]
+
+  ws = Workspace(cfg)
+  try:
+    r, out, err, fname = latex("".join([cfg.batch_page % src
+      for k, src in todo]), cfg, ws)
+    root, ext = os.path.splitext(fname)
+    pngs = None
+    if r == 0:
+      pngs = dvipng_pages(root + '.dvi', len(todo), cfg)
+  finally:
+    if not cfg.keepfiles: ws.remove()
+
+  if pngs is None:
+    pngs = []
+    for k, src in todo:
+      pngfile = tex2png(src, cfg)
+      if pngfile:
+        pngs.append(read_file(pngfile))
+        cleanup(os.path.splitext(pngfile)[0], cfg)
+      else:
+        pngs.append(None)
+
+  for (k, src), png in zip(todo, pngs):
+    found[k] = png
+    if cfg.cache is not None: cfg.cache.put(k, png, cfg.backend)
+  return [found[k] for k in keys]
+
+
+#;;;;;;;;;;;;;;;;;;;;
+# Class Workspace ;;;
+#;;;;;;;;;;;;;;;;;;;;
+
+class Workspace():
+  """
+  A private directory in cfg.tmpdir (RAM-backed if possible) for the files
+  of one render; remove() (or the end of a with statement) deletes it
+  with everything in it.
+  Example:
+    with Workspace(cfg) as ws:
+      r, out, err, texfile = latex(src, cfg, ws)
+  """
+  def __init__(self, cfg = fs()):
+    self.cfg = cfg
+    self.path = mkdtemp(prefix = cfg.tmp_prefix, dir = cfg.tmpdir)
+
+
+  def __enter__(self):
+    return self
+
+
+  def __exit__(self, *args):
+    self.remove()
+
+
+  def read(self, filename):
+    """
+    Return the contents of filename (relative to the workspace or absolute)
+    or None.
+    """
+    return read_file(os.path.join(self.path, filename))
+
+
+  def usage(self):
+    """
+    Return: number of files and bytes in the workspace.
+    """
+    return usage(self.path)
+
+
+  def remove(self):
+    """
+    Delete the workspace. Return: True if it is gone.
+    """
+    shutil.rmtree(self.path, ignore_errors = True)
+    return not os.path.exists(self.path)
+
+
+def usage(path = None, cfg = fs()):
+  """
+  Count the files and bytes below path, default: all temporary files and
+  workspaces of this module in cfg.tmpdir (use it to check for leftovers).
+  Return: {'files': n, 'bytes': n}
+  """
+  if path is None:
+    top = cfg.tmpdir or gettempdir()
+    paths = [os.path.join(top, f) for f in os.listdir(top)
+      if f.startswith(cfg.tmp_prefix)]
+  else:
+    paths = [path]
+  files = nbytes = 0
+  for p in paths:
+    if os.path.isdir(p):
+      for root, dirs, names in os.walk(p):
+        for name in names:
+          try:
+            nbytes += os.path.getsize(os.path.join(root, name))
+            files += 1
+          except OSError:
+            pass
+    else:
+      try:
+        nbytes += os.path.getsize(p)
+        files += 1
+      except OSError:
+        pass
+  return {'files':files, 'bytes':nbytes}
+
+
+def tex2bytes(src, cfg):
+  """
+  Render src in a workspace (removed afterwards).
+  Return: the PNG image (SVG if cfg.backend = 'svg') or None.
+  """
+  with Workspace(cfg) as ws:
+    r, out, err, fname = latex(src, cfg, ws)
+    if r != 0: return None
+    root, ext = os.path.splitext(fname)
+    r, out, err, imgfile = dvi2img(root + '.dvi', cfg)
+    if r != 0: return None
+    return ws.read(imgfile)
+
+
+def tex2pdf_bytes(src, cfg):
+  """
+  Run pdflatex on src in a workspace (removed afterwards).
+  Return: the PDF document or None.
+  """
+  with Workspace(cfg) as ws:
+    r, out, err, pdffile = pdflatex(src, cfg, ws)
+    if r != 0: return None
+    return ws.read(pdffile)
 
 
 #;;;;;;;;;;;;;;
@@ -238,6 +589,10 @@ class TeX():
     self.dvifile = None
     self.pngfile = None
     self.png = None
+    self.svg = None
+
+    # Timing record of the last tex2png (texstats.Timing)
+    self.timing = None
 
     if auto: self.tex2png(src)
 
@@ -247,7 +602,10 @@ class TeX():
     Run latex on the tex source src.
     Return: Popen return code (integer).
     """
+    t = texstats.Timer()
     r, out, err, texfname = latex(src, self.cfg)
+    if self.timing is not None:
+      self.timing.latex, self.timing.latex_cpu = t.stop()
     self.latex_output = out
     self.latex_errlog = err
     self.tex_filename = texfname
@@ -256,10 +614,13 @@ class TeX():
 
   def do_dvipng(self, dvifile):
     """
-    Create a png image from the dvi file dvifile.
+    Create a png (svg) image from the dvi file dvifile.
     Return: Popen return code (integer).
     """
-    r, out, err, pngfile = dvipng(dvifile, self.cfg)
+    t = texstats.Timer()
+    r, out, err, pngfile = dvi2img(dvifile, self.cfg)
+    if self.timing is not None:
+      self.timing.dvipng, self.timing.dvipng_cpu = t.stop()
     self.dvipng_output = out
     self.dvipng_errlog = err
     self.pngfile = pngfile
@@ -268,21 +629,82 @@ class TeX():
 
   def tex2png(self, src):
     """
-    Create a png image from the tex source src. The png file name is stored
-    in self.pngfile.
+    Create a png image from the tex source src and read it into self.png
+    (self.svg). The temp files are removed unless cfg.keepfiles, then the
+    png file name is stored in self.pngfile.
     Return: True or False
     """
-    if bool(self.do_latex(src)): return False
-    root, ext = os.path.splitext(self.tex_filename)
-    self.dvifile = root + '.dvi'
-    if bool(self.do_dvipng(self.dvifile)): return False
+    self.timing = texstats.Timing()
+    key = cache_key(src, self.cfg)
+    if self.cfg.cache is not None:
+      png = self.cfg.cache.get(key, self.cfg.backend)
+      if png is not None:
+        self.set_image(png)
+        self.timing.done(png, 'hit')
+        return True
+    if self.cfg.flights is None:
+      r = self._tex2png(src, key)
+      self.timing.done(r and self.get_image() or None)
+      return r
+    ran = []
+    def run():
+      ran.append(True)
+      return self._tex2png(src, key) and self.get_image()
+    png = self.cfg.flights.do(key, run) or None
+    if ran:
+      self.timing.done(png)
+    else:
+      self.timing.queue = time.time() - self.timing.start
+      self.timing.done(png, 'shared')
+    if not png: return False
+    self.set_image(png)
     return True
 
 
+  def _tex2png(self, src, key):
+    """
+    Run latex and dvipng on src, read the image into self.png and store
+    it in cfg.cache.
+    Return: True or False
+    """
+    try:
+      if bool(self.do_latex(src)): return False
+      root, ext = os.path.splitext(self.tex_filename)
+      self.dvifile = root + '.dvi'
+      if bool(self.do_dvipng(self.dvifile)): return False
+      self.set_image(read_file(self.pngfile))
+    finally:
+      if not self.cfg.keepfiles and self.tex_filename is not None:
+        self.cleanup()
+        self.pngfile = None
+    if self.cfg.cache is not None:
+      self.cfg.cache.put(key, self.get_image(), self.cfg.backend)
+    return True
+
+
+  def get_image(self):
+    """
+    The PNG image (the SVG image if cfg.backend = 'svg').
+    """
+    if self.cfg.backend == 'svg': return self.svg
+    return self.png
+
+
+  def set_image(self, img):
+    """
+    Set the PNG image (the SVG image if cfg.backend = 'svg').
+    """
+    if self.cfg.backend == 'svg':
+      self.svg = img
+    else:
+      self.png = img
+
+
   def cleanup(self):
     """
     Remove all (by this instance) produced temp files.
     """
+    if self.tex_filename is None: return True
     root, ext = os.path.splitext(self.tex_filename)
     return cleanup(root, self.cfg)
 
@@ -294,6 +716,7 @@ class TeX():
     """
     self.pngfile = None
     self.png = None
+    self.svg = None
     self.latex_errlog = None
     self.dvipng_errlog = None
     self.latex_output = None
@@ -316,6 +739,7 @@ class TeX():
     and/or notebook.
     """
     if not self.cfg.repr_png: return None
+    if self.cfg.backend == 'svg': return None
     if self.png is not None:
       return self.png
     else:
@@ -325,6 +749,28 @@ class TeX():
         f.close()
         return self.png
 
+
+  def _repr_svg_(self):
+    """
+    Representation method for SVG image (cfg.backend = 'svg').
+    """
+    return self.svg
+
+
+def tex_batch(srcs, cfg = fs()):
+  """
+  Create a TeX instance for each TeX source string in srcs, all images
+  rendered by tex2png_batch (a single latex and dvipng run).
+  Return: the list of TeX instances.
+  """
+  objs = []
+  for src, png in zip(srcs, tex2png_batch(srcs, cfg)):
+    t = TeX(src, cfg, auto = False)
+    t.set_image(png)
+    objs.append(t)
+  return objs
+
+
 #;;;;;;;;;;;;;;;;;
 # Main section ;;;
 #;;;;;;;;;;;;;;;;;
@@ -11,6 +11,9 @@ Axiom0:
   - Low level class: with an instance of this class one can already
     communicate with Axiom on a send input string get output string
     basis.
+AsyncAxiom:
+  - Same interface as Axiom0, but driven by an asyncore loop; the calls
+    return Pending instances instead of blocking.
 Axiom1:
   - Input class
 Axiom2:
@@ -26,7 +29,14 @@ import sys
 import time
 import tempfile
 import os, os.path
+import select
+import hashlib
+import threading
+import asyncore
 import termcolor
+from collections import deque
+import memo
+import axparse
 
 if os.name == 'nt':
   import winpexpect as xp
@@ -56,12 +66,189 @@ fs.appname = "openaxiom"
 # the regexp pattern below should match.
 fs.prompt_re = "\([0-9]+\) ->"
 
+# Upper bound for the length of a prompt. Incremental readers only search
+# the newly read bytes plus this overlap for the prompt.
+fs.prompt_maxlen = 32
+
+# Bytes read from the pty at once by the incremental readers.
+fs.maxread = 4096
+
+# AsyncAxiom: seconds after which a request (from queuing to its prompt)
+# fails, or None (no limit). Checked whenever the asyncore loop polls.
+fs.request_timeout = None
+
+# Seconds pexpect sleeps before each send (its default is 0.05, i.e. 50 ms
+# added to every command). Axiom reads complete lines, no delay is needed.
+fs.delaybeforesend = 0
+
+# Axiom0: read the pty with PtyReader instead of pexpect's expect (posix).
+fs.use_ptyreader = os.name != 'nt'
+
+# Seconds Axiom0 waits for the extra prompt Axiom prints when an interrupt
+# was sent after the final prompt of the command had been read (see
+# Axiom0.interrupt).
+fs.interrupt_grace = 0.5
+
 # Read quiet command (read in a file)
 fs.cmd_read_quiet = ')read "{}" )quiet'
 
 # Tempfile generation template (used by NamedTemporaryFile)
 fs.tmpfile_kw = {'prefix':'ax$', 'suffix':'.input', 'delete':False}
 
+# Input file reused by write for the whole session (created in start and
+# removed in stop) instead of a new temp file per call. It is placed into
+# inputdir, a RAM-backed directory if available (None: system temp dir).
+fs.reuse_inputfile = True
+if os.path.isdir('/dev/shm'):
+  fs.inputdir = '/dev/shm'
+else:
+  fs.inputdir = None
+
+# Commands sent (line by line) right after the banner has been read, e.g.
+# [")set output tex on", ")set output algebra off"].
+fs.cmd_init = []
+
+# Keep a journal of the inputs which change the session state (see
+# memo.ispure), e.g. to restore a session in another process.
+fs.journal = False
+
+# Result cache (memo.ResultCache instance, may be shared) used by writeln
+# and write, or None. On a hit this command (no output) is sent once per
+# step the cached output took, so that Axiom's step numbers stay in sync;
+# the values are not: % and %%(n) of such a step refer to the value of
+# this command, not to the cached output. Don't use the cache in sessions
+# whose inputs refer to previous results (wax.py sessions don't).
+fs.cache = None
+fs.cache_step_cmd = "0;"
+
+# Batch input (write_batch): a system command printing a marker with the
+# number of the following command, and the regexp matching the marker line
+# and the 'Value = NIL' line Axiom prints after it.
+fs.batch_marker_cmd = ')lisp (progn (princ "@@wax:{0}@@") nil)'
+fs.batch_marker_re = "@@wax:([0-9]+)@@[^\n]*\n?(?:\\s*Value = NIL[^\n]*\n?)?"
+
+# writeln and write return an axparse.Result (step index, elapsed time,
+# output; parsed on demand) instead of True. The last 'history' results
+# are kept in Axiom0.history (0: none).
+fs.results = False
+fs.history = 1000
+
+
+class PtyReader():
+  """
+  Incremental reader for the pty of a spawned process (posix only).
+  The data is read with select/os.read into a bytearray; the prompt is
+  searched only in the newly arrived bytes (plus maxlen bytes overlap), so
+  the cost per byte does not grow with the size of the output.
+  After expect matched, 'before' is a memoryview of the output (no copy)
+  and 'after' the prompt; both stay valid until the next expect.
+  """
+
+  def __init__(self, fd, prompt_re, maxlen = 32, maxread = 4096):
+    """
+    fd: the pty file descriptor (e.g. spawn(...).child_fd), prompt_re: the
+    prompt regexp, maxlen: upper bound of the prompt length, maxread: bytes
+    read at once.
+    """
+    self.fd = fd
+    self.rx = re.compile(prompt_re)
+    self.maxlen = maxlen
+    self.maxread = maxread
+
+    # Data read, the bytes before 'start' have been consumed
+    self.buf = bytearray()
+    self.start = 0
+
+    # No prompt starts before searched - maxlen
+    self.searched = 0
+
+    # Output before the prompt (memoryview) and the prompt (str)
+    self.before = None
+    self.after = None
+
+
+  def fill(self, timeout):
+    """
+    Wait at most timeout seconds for data and append it to the buffer.
+    Return the number of bytes read (0 on timeout), raise EOFError on EOF.
+    """
+    r, w, e = select.select([self.fd], [], [], timeout)
+    if not r: return 0
+    try:
+      data = os.read(self.fd, self.maxread)
+    except OSError: # EIO: the slave side has been closed
+      data = ''
+    if not data: raise EOFError
+    self.buf += data
+    return len(data)
+
+
+  def search(self):
+    """
+    Search the prompt in the data not searched so far. Return the match
+    object or None.
+    """
+    pos = max(self.start, self.searched - self.maxlen)
+    self.searched = len(self.buf)
+    return self.rx.search(self.buf, pos)
+
+
+  def pending(self):
+    """
+    Number of bytes read but not consumed.
+    """
+    return len(self.buf) - self.start
+
+
+  def take(self, n):
+    """
+    Consume and return (as str) the next n bytes.
+    """
+    chunk = str(self.buf[self.start:self.start+n])
+    self.start += n
+    del self.buf[:self.start]
+    self.searched = max(0, self.searched - self.start)
+    self.start = 0
+    return chunk
+
+
+  def consume(self, m):
+    """
+    Set before/after from the match m and drop the data up to the end of
+    the prompt. The old buffer is left to the 'before' view.
+    """
+    self.before = memoryview(self.buf)[self.start:m.start()]
+    self.after = str(m.group())
+    self.buf = self.buf[m.end():]
+    self.start = 0
+    self.searched = 0
+
+
+  def expect(self, timeout = None):
+    """
+    Read until the prompt has been matched (return 0), EOF (return 1) or
+    timeout seconds have passed (return 2), i.e. as in pexpect's expect
+    with the pattern list [prompt_re, EOF, TIMEOUT]. With timeout 0 only
+    the data already available is read.
+    """
+    if timeout is not None:
+      deadline = time.time() + timeout
+    while True:
+      m = self.search()
+      if m is not None:
+        self.consume(m)
+        return 0
+      if timeout is None:
+        remaining = None
+      else:
+        remaining = max(0, deadline - time.time())
+      try:
+        n = self.fill(remaining)
+      except EOFError:
+        return 1
+      if not n and remaining == 0: return 2
+
+
 
 class Axiom0():
   """
@@ -104,15 +291,58 @@ class Axiom0():
     # Log file ([win]spawn)
     self.logfile = None
 
+    # Outputs of the commands of the last write_batch
+    self.outputs = None
+
+    # Session input file used by write (see fs.reuse_inputfile)
+    self.inputfile = None
+
+    # PtyReader (see fs.use_ptyreader)
+    self.reader = None
+
+    # Result cache (see fs.cache) and the fingerprint of the session state,
+    # i.e. of all inputs the cache does not accept
+    self.cache = cfg.cache
+    self.fingerprint = hashlib.sha1(cfg.appname).hexdigest()
+
+    # The echo of the command sent by write (see _strip_echo)
+    self.echo_read = re.compile(re.escape(cfg.cmd_read_quiet).replace(
+      re.escape("{}"), ".*"))
+
+    # Inputs which changed the state since start (see fs.journal) or None
+    self.journal = None
+
+    # A command is in progress / has been interrupted (see interrupt), its
+    # final prompt has been read / the interrupt was sent after that
+    self.busy = False
+    self.interrupted = False
+    self.prompted = False
+    self.late = False
+    self.busy_lock = threading.Lock()
+
+    # The last results (see fs.results, fs.history)
+    self.history = deque(maxlen = cfg.history)
+
 
   def _axp_expect(self):
     """
     Return True if the prompt was matched otherwise return False and
     set the error=1 if EOF or error=2 if Timeout.
+    With a PtyReader the result is stored in axp.before/axp.after as
+    pexpect would do.
     """
-    self.error = self.axp.expect([self.cfg.prompt_re, xp.EOF, xp.TIMEOUT])
+    if self.reader is not None:
+      self.error = self.reader.expect(self.axp.timeout)
+      if self.error == 0:
+        self.axp.before = self.reader.before.tobytes()
+        self.axp.after = self.reader.after
+    else:
+      self.error = self.axp.expect([self.cfg.prompt_re, xp.EOF, xp.TIMEOUT])
     if self.error == 0:
       self.error = None
+      self.busy_lock.acquire()
+      self.prompted = True
+      self.busy_lock.release()
       return True
     else:
       return False
@@ -124,8 +354,69 @@ class Axiom0():
      reset the error state. Return is as in _axp_expect.
      """
      self.error = None
-     n = self.axp.sendline(txt) #chk n>=len(txt) ?
-     return self._axp_expect()
+     self._set_busy(True)
+     try:
+       n = self.axp.sendline(txt) #chk n>=len(txt) ?
+       return self._axp_expect()
+     finally:
+       self._set_busy(False)
+
+
+  def _set_busy(self, busy):
+    """
+    Mark a command as being in progress (or done), see interrupt. If the
+    command has been interrupted after its final prompt had been read,
+    Axiom prints an extra prompt, which is waited for (cfg.interrupt_grace);
+    after other interrupts only a prompt already read from the pty (the
+    interrupt arrived while Axiom printed the final prompt) is dropped.
+    """
+    self.busy_lock.acquire()
+    drain = not busy and self.busy and self.interrupted
+    grace = self.late and self.cfg.interrupt_grace or 0
+    self.busy = busy
+    if busy: self.interrupted = self.prompted = self.late = False
+    self.busy_lock.release()
+    if drain: self._drain_prompt(grace)
+
+
+  def _drain_prompt(self, timeout):
+    """
+    Read a prompt arriving within timeout seconds (0: already there); the
+    output before it is dropped (axp.before stays that of the last command).
+    """
+    if not self.isalive(): return
+    before, after = self.axp.before, self.axp.after
+    if self.reader is not None:
+      if self.reader.expect(timeout) == 0:
+        after = self.prompt = self.reader.after
+    elif self.axp.expect([self.cfg.prompt_re, xp.EOF, xp.TIMEOUT],
+      timeout = timeout) == 0:
+      after = self.prompt = self.axp.after
+    self.axp.before, self.axp.after = before, after
+
+
+  def interrupt(self):
+    """
+    Cancel the command in progress (sent by another thread) by sending the
+    terminal interrupt (Ctrl-C) to Axiom. Axiom abandons the computation
+    and falls back to its prompt, which the waiting writeln/write reads as
+    usual (the prompt state stays in sync); 'interrupted' is set to True.
+    Nothing is sent if no command is in progress. The check and the send
+    hold the lock that clears busy; an interrupt sent after the final prompt
+    had been read yields a second prompt, which is read when busy is
+    cleared (see _set_busy).
+    Return True if the interrupt was sent.
+    """
+    self.busy_lock.acquire()
+    try:
+      if not (self.busy and self.isalive()):
+        return False
+      self.axp.sendintr()
+      self.interrupted = True
+      self.late = self.prompted
+      return True
+    finally:
+      self.busy_lock.release()
 
 
   def start(self, **kwargs):
@@ -137,6 +428,7 @@ class Axiom0():
       args=[], timeout=30, maxread=2000, searchwindowsize=None
       logfile=None, cwd=None, env=None, username=None, domain=None
       password=None
+    The commands in cfg.cmd_init are sent after the banner has been read.
     For details consult the pexpect manual as this parameters are the same
     as in the spawn/winspawn function respectively.
     Note: after started one may access the values as follows:
@@ -144,14 +436,35 @@ class Axiom0():
     """
     if self.axp is None:
       self.axp = spawn(self.cfg.appname, **kwargs)
+      self.axp.delaybeforesend = self.cfg.delaybeforesend
+      if self.cfg.use_ptyreader:
+        self.reader = PtyReader(self.axp.child_fd, self.cfg.prompt_re,
+          self.cfg.prompt_maxlen, self.cfg.maxread)
       if self._axp_expect():
         self.banner = self.axp.before
         self.prompt = self.axp.after
+        for cmd in self.cfg.cmd_init:
+          if not self.writeln(cmd): return False
+        self.output = None
+        if self.cfg.journal:
+          self.journal = []
+        if self.cfg.reuse_inputfile:
+          self._create_inputfile()
         return True
       else:
         return False
 
 
+  def _create_inputfile(self):
+    """
+    Create the session input file (overwritten by each write) in
+    cfg.inputdir.
+    """
+    fd, self.inputfile = tempfile.mkstemp(self.cfg.tmpfile_kw['suffix'],
+      self.cfg.tmpfile_kw['prefix'], self.cfg.inputdir)
+    os.close(fd)
+
+
   def stop(self):
     """
     Stop Axiom (the hard way). One may also send the command ')quit'
@@ -161,6 +474,13 @@ class Axiom0():
     if self.axp is not None:
       self.axp.close()
       self.axp = None
+    self.reader = None
+    if self.inputfile is not None:
+      try:
+        os.unlink(self.inputfile)
+      except OSError:
+        pass
+      self.inputfile = None
     return not self.isalive()
 
 
@@ -188,6 +508,89 @@ class Axiom0():
     return self.output is not None
 
 
+  def _index(self):
+    """
+    The step number N of the current prompt (N) -> or None.
+    """
+    m = re.match(r"\(([0-9]+)\)", self.prompt or "")
+    return m and int(m.group(1))
+
+
+  def _record(self, src):
+    """
+    Called after src has been sent: fold an input which changes the state
+    into the fingerprint (even if it failed, it may have changed the state)
+    and add it to the journal (if kept) unless it was interrupted or did not
+    complete (timeout, EOF), so that a restore does not replay a runaway
+    computation. Inputs with error messages are kept: other statements of
+    the input may have succeeded, the errors are repeated by the replay
+    (which goes on after them).
+    """
+    if self.cache is not None:
+      if self.cache.cacheable(src): return
+    elif memo.ispure(src):
+      return
+    self.fingerprint = hashlib.sha1(self.fingerprint + "\n" +
+      memo.normalize(src)).hexdigest()
+    if self.journal is None: return
+    if self.error is not None or self.interrupted: return
+    self.journal.append(src)
+
+
+  def _cached(self, src, send, method):
+    """
+    Look up src (sent by method) in the cache, on a miss call send(src) and
+    store the output without the echo of the input. On a hit Axiom's step
+    number is advanced (see fs.cache_step_cmd, % then refers to the value of
+    that command); the output has no echo.
+    Inputs the cache does not accept are sent and recorded.
+    """
+    if not self.cache.cacheable(src):
+      rc = send(src)
+      self._record(src)
+      return rc
+    key = self.cache.key(src, self.fingerprint, method)
+    index = self._index()
+    output, steps = self.cache.fetch(key, index)
+    if output is not None:
+      if not self._advance(steps): return False
+      self.error = None
+      self.output = output
+      return True
+    rc = send(src)
+    if rc and not self.interrupted:
+      steps = 1
+      if index is not None and self._index() is not None:
+        steps = self._index() - index
+      self.cache.put(key, self._strip_echo(src, self.output), index, steps)
+    return rc
+
+
+  def _strip_echo(self, src, output):
+    """
+    The output without the first line if it is the echo of src or of the
+    command sent by write (it differs between sessions).
+    """
+    line, sep, rest = output.partition("\n")
+    line = line.strip()
+    if sep and (line == src.strip() or self.echo_read.match(line)):
+      return rest
+    return output
+
+
+  def _advance(self, steps):
+    """
+    Send cfg.cache_step_cmd steps times (output dropped). Return False on
+    error (output is None then).
+    """
+    for i in range(steps):
+      if not self._axp_sendline(self.cfg.cache_step_cmd):
+        self.output = None
+        return False
+      self.prompt = self.axp.after
+    return True
+
+
   def writeln(self, src):
     """
     Write a line to Axiom, i.e. as if it were entered into the interactive
@@ -195,8 +598,22 @@ class Axiom0():
     Note: src should not contain any control characters; a newline (in fact
     os.linesep) will be added automatically. Axiom's continuation character,
     however, is no problem.
+    With a result cache (cfg.cache) pure inputs may be answered from it.
+    If cfg.results is set an axparse.Result is returned instead of True.
     """
+    index, t = self._index(), time.time()
+    if self.cache is not None:
+      rc = self._cached(src, self._writeln, 'writeln')
+    else:
+      rc = self._writeln(src)
+      self._record(src)
+    return self._result(rc, index, t)
 
+
+  def _writeln(self, src):
+    """
+    writeln without cache; write sends its read command through it.
+    """
     if self._axp_sendline(src):
       self.output = self.axp.before
       self.prompt = self.axp.after
@@ -218,22 +635,594 @@ class Axiom0():
       return False
 
 
-  def write(self, src):
+  def _axp_iter(self, src, keep = True):
+    """
+    Send src when the iteration starts (nothing is sent and the session is
+    not busy before), then yield the output as it arrives on the pty until
+    the prompt is matched (chunks never contain the prompt). Then set
+    output/prompt as writeln does; on EOF/timeout (no data within
+    axp.timeout seconds) set error as _axp_expect does and set output to
+    None.
+    If keep is False the chunks are not kept and output is set to None.
+    If the caller abandons the iteration the remaining output is read
+    (blocking) so that the next command finds the prompt in sync.
+    """
+    rx = re.compile(self.cfg.prompt_re)
+    hold = self.cfg.prompt_maxlen
+    chunks = []
+    sent = done = False
+    self.error = None
+    self.output = None
+    self._set_busy(True)
+    try:
+      self.axp.sendline(src)
+      sent = True
+      buf = self.axp.buffer
+      self.axp.buffer = ''
+      while True:
+        m = rx.search(buf)
+        if m is not None:
+          if m.start() > 0:
+            if keep: chunks.append(buf[:m.start()])
+            yield buf[:m.start()]
+          self.axp.buffer = buf[m.end():]
+          self.output = keep and ''.join(chunks) or None
+          self.prompt = m.group()
+          done = True
+          return
+        if len(buf) > hold:
+          if keep: chunks.append(buf[:-hold])
+          yield buf[:-hold]
+          buf = buf[-hold:]
+        try:
+          buf += self.axp.read_nonblocking(self.cfg.maxread, self.axp.timeout)
+        except xp.EOF:
+          self.error = 1
+        except xp.TIMEOUT:
+          self.error = 2
+        if self.error is not None:
+          self.output = None
+          done = True
+          return
+    finally:
+      if sent and not done:
+        self.axp.buffer = buf
+        if self._axp_expect():
+          self.prompt = self.axp.after
+        self.output = None
+      self._set_busy(False)
+
+
+  def _reader_iter(self, src, keep = True):
+    """
+    The same as _axp_iter, but reading with the PtyReader.
+    """
+    rd = self.reader
+    hold = self.cfg.prompt_maxlen
+    chunks = []
+    sent = done = False
+    self.error = None
+    self.output = None
+    self._set_busy(True)
+    try:
+      self.axp.sendline(src)
+      sent = True
+      while True:
+        m = rd.search()
+        if m is not None:
+          rd.consume(m)
+          if len(rd.before):
+            chunk = rd.before.tobytes()
+            if keep: chunks.append(chunk)
+            yield chunk
+          self.output = keep and ''.join(chunks) or None
+          self.prompt = rd.after
+          self.axp.before = self.output
+          self.axp.after = self.prompt
+          done = True
+          return
+        if rd.pending() > hold:
+          chunk = rd.take(rd.pending() - hold)
+          if keep: chunks.append(chunk)
+          yield chunk
+        try:
+          if not rd.fill(self.axp.timeout):
+            self.error = 2
+        except EOFError:
+          self.error = 1
+        if self.error is not None:
+          self.output = None
+          done = True
+          return
+    finally:
+      if sent and not done:
+        if self._axp_expect():
+          self.prompt = self.axp.after
+        self.output = None
+      self._set_busy(False)
+
+
+  def writeln_iter(self, src, keep = True):
+    """
+    As writeln, but return an iterator over the output chunks as they
+    arrive (see _axp_iter). 'output' is set when the iteration is complete
+    (if keep is True, otherwise it stays None).
+    The result cache is not used (but state changes are recorded).
+    """
+    return self._recorded(src, self._writeln_iter(src, keep))
+
+
+  def _recorded(self, src, it):
+    """
+    Yield the chunks of the iterator it, then record src (see _record).
+    """
+    try:
+      for chunk in it:
+        yield chunk
+    finally:
+      it.close()
+      self._record(src)
+
+
+  def _writeln_iter(self, src, keep = True):
+    """
+    writeln_iter without recording src.
+    """
+    if self.reader is not None:
+      return self._reader_iter(src, keep)
+    return self._axp_iter(src, keep)
+
+
+  def write_iter(self, src, keep = True):
+    """
+    As write, but return an iterator over the output chunks as they arrive.
+    """
+    return self._recorded(src, self._write_iter(src, keep))
+
+
+  def _write_iter(self, src, keep = True):
+    """
+    write_iter without recording src: when the iteration starts src is
+    written into the session input file (or a new temp file, removed at
+    the end, see _write) and read in by Axiom.
+    """
+    tmp = self.inputfile is None
+    if tmp:
+      f = tempfile.NamedTemporaryFile(**self.cfg.tmpfile_kw)
+      name = f.name
+    else:
+      name = self.inputfile
+      f = open(name, 'w')
+    f.write(src)
+    f.close()
+    it = self._writeln_iter(self.cfg.cmd_read_quiet.format(name), keep)
+    try:
+      for chunk in it:
+        yield chunk
+    finally:
+      it.close()
+      if tmp: os.unlink(name)
+
+
+  def writeln_stream(self, src):
+    """
+    As writeln, but parse the output while it arrives: return an iterator
+    over the (kind, data) pairs of axparse.stream (rows, TeX fragments,
+    types). The output is not kept ('output' stays None), so very large
+    results are never held in memory as a whole.
+    """
+    return axparse.stream(self.writeln_iter(src, False))
+
+
+  def write_stream(self, src):
+    """
+    As write, but parse the output while it arrives (see writeln_stream).
+    """
+    return axparse.stream(self.write_iter(src, False))
+
+
+  def write(self, src, record = True):
     """
     Place the string src into a temp file and call writef, that is command
     Axiom to read in the temp file. Note: the temp file will be deleted
     after having been raed into Axiom.
+    If the session has an input file (cfg.reuse_inputfile) it is overwritten
+    instead, so no file is created or deleted per call.
     This command allows multiline input in SPAD/Aldor form.
+    With a result cache (cfg.cache) pure inputs may be answered from it.
+    With record = False the input bypasses the cache and is not recorded
+    (journal, fingerprint), for inputs whose state change does not matter
+    (e.g. the data dumps of axnum).
+    If cfg.results is set an axparse.Result is returned instead of True.
+    """
+    index, t = self._index(), time.time()
+    if not record:
+      rc = self._write(src)
+    elif self.cache is not None:
+      rc = self._cached(src, self._write, 'write')
+    else:
+      rc = self._write(src)
+      self._record(src)
+    return self._result(rc, index, t)
+
+
+  def _result(self, rc, index, t):
+    """
+    Return rc or, if cfg.results is set and rc is True, the Result of the
+    output (step index, elapsed time since t) and add it to the history.
+    """
+    if not (rc and self.cfg.results): return rc
+    r = axparse.Result(self.output, index, time.time() - t)
+    if self.cfg.history: self.history.append(r)
+    return r
+
+
+  def _write(self, src):
+    """
+    write without cache.
     """
+    if self.inputfile is not None:
+      f = open(self.inputfile, 'w')
+      f.write(src)
+      f.close()
+      return self._writeln(self.cfg.cmd_read_quiet.format(self.inputfile))
 
     tmpf = tempfile.NamedTemporaryFile(**self.cfg.tmpfile_kw)
     tmpf.write(src)
     tmpf.close()
-    rc = self.writef(tmpf.name)
+    rc = self._writeln(self.cfg.cmd_read_quiet.format(tmpf.name))
     os.unlink(tmpf.name)
     return rc
 
 
+  def write_batch(self, commands):
+    """
+    Send all commands (strings, possibly multiline) in a single write,
+    separated by marker commands (cfg.batch_marker_cmd), and split the
+    output at the markers. The raw output of each command is stored in
+    'outputs'.
+    Return: a list of (index, type, output) triples, one per command, where
+    index is the step number (string) and type the 'Type:' of the result
+    (None if there is none), or False on error.
+    """
+    marker = self.cfg.batch_marker_cmd
+    src = []
+    for i, cmd in enumerate(commands):
+      src.append(marker.format(i))
+      src.append(cmd)
+    src.append(marker.format(len(commands)))
+    self.outputs = None
+    if not self.write("\n".join(src)):
+      return False
+
+    parts = re.split(self.cfg.batch_marker_re, self.output)
+    outputs = [None] * len(commands)
+    for k in range(1, len(parts) - 1, 2):
+      i = int(parts[k])
+      if i < len(commands): outputs[i] = parts[k+1]
+    self.outputs = outputs
+
+    result = []
+    for out in outputs:
+      if out is None:
+        result.append((None, None, None))
+        continue
+      ri = re.search(r"^\s*\(([0-9]+)\)", out, re.M)
+      rt = re.findall(r"Type:\s*(.*\S)", out)
+      result.append((ri and ri.group(1), rt and rt[-1] or None, out))
+    return result
+
+
+
+
+class Pending():
+  """
+  Placeholder for the outcome of an AsyncAxiom call. It is resolved by the
+  asyncore loop as soon as the prompt has been read:
+    - ok: True (prompt matched) or False (EOF, stopped, timeout)
+    - output, prompt: as in Axiom0
+  Callbacks added by add_callback are called with the Pending instance.
+  """
+
+  def __init__(self, timeout = None):
+    """
+    timeout: seconds after which the request fails (None: no limit).
+    """
+    self.deadline = None
+    if timeout is not None: self.deadline = time.time() + timeout
+    self.done = False
+    self.ok = None
+    self.output = None
+    self.prompt = None
+    self.callbacks = []
+
+
+  def add_callback(self, fn):
+    """
+    Call fn(self) when resolved (immediately if already done).
+    """
+    if self.done:
+      fn(self)
+    else:
+      self.callbacks.append(fn)
+
+
+  def resolve(self, ok, output = None, prompt = None):
+    """
+    Set the outcome and run the callbacks.
+    """
+    self.done = True
+    self.ok = ok
+    self.output = output
+    self.prompt = prompt
+    callbacks, self.callbacks = self.callbacks, []
+    for fn in callbacks:
+      fn(self)
+
+
+  def wait(self, timeout = None, map = None):
+    """
+    Run the asyncore loop until resolved or timeout seconds have passed.
+    Return ok (None on timeout).
+    """
+    if timeout is not None:
+      deadline = time.time() + timeout
+    while not self.done:
+      if timeout is None:
+        asyncore.loop(timeout = 0.1, map = map, count = 1)
+      else:
+        remaining = deadline - time.time()
+        if remaining <= 0: break
+        asyncore.loop(timeout = min(0.1, remaining), map = map, count = 1)
+    return self.ok
+
+
+
+class _PtyDispatcher(asyncore.file_dispatcher):
+  """
+  Hand the bytes read from the Axiom pty to the owning AsyncAxiom.
+  """
+
+  def __init__(self, owner, fd, map = None):
+    asyncore.file_dispatcher.__init__(self, fd, map)
+    self.owner = owner
+
+  def writable(self):
+    return False
+
+  def readable(self):
+    self.owner._expire() # called on every poll of the loop
+    return True
+
+  def handle_read(self):
+    try:
+      data = self.recv(self.owner.cfg.maxread)
+    except OSError:
+      data = ''
+    if data:
+      self.owner._feed(data)
+    else:
+      self.handle_close()
+
+  def handle_close(self):
+    self.close()
+    self.owner._eof()
+
+
+
+class AsyncAxiom():
+  """
+  Non-blocking counterpart of Axiom0 (posix only). The pty of the Axiom
+  process is served by an asyncore dispatcher, so that one asyncore loop
+  may drive many sessions (and e.g. an asyncore based HTTP server).
+    - start, writeln, writef, write return a Pending instance
+    - requests are queued and sent one after the other
+    - stop
+  Example:
+    a = AsyncAxiom(); a.start().wait()
+    r = a.writeln("integrate(x^2,x)"); r.wait(); print r.output
+  """
+
+  def __init__(self, cfg = fs(), map = None):
+    """
+    The argument cfg has to be an instance of the factory settings, map
+    is the asyncore socket map (None: the global one).
+    """
+    self.cfg = cfg
+    self.map = map
+
+    # The pexpect instance (only used to spawn/close the process)
+    self.axp = None
+
+    # The asyncore dispatcher for the pty
+    self.dispatcher = None
+
+    # Compiled prompt pattern
+    self.prompt_rx = re.compile(cfg.prompt_re)
+
+    # Bytes read but not yet consumed
+    self.buffer = ''
+
+    # Pending requests: [(line, Pending)], the first one has been sent
+    self.queue = []
+
+    # As in Axiom0
+    self.banner = None
+    self.prompt = None
+    self.output = None
+    self.error = None
+
+
+  def _feed(self, data):
+    """
+    Append data to the buffer and resolve requests whose prompt arrived.
+    Only the new data (plus a few bytes overlap) is searched.
+    """
+    pos = max(0, len(self.buffer) - self.cfg.prompt_maxlen)
+    self.buffer += data
+    while self.queue:
+      m = self.prompt_rx.search(self.buffer, pos)
+      if m is None: break
+      before = self.buffer[:m.start()]
+      self.buffer = self.buffer[m.end():]
+      pos = 0
+      self.prompt = m.group()
+      line, pending = self.queue.pop(0)
+      if line is None:
+        self.banner = before
+      else:
+        self.output = before
+      if not pending.done: # else timed out
+        pending.resolve(True, before, self.prompt)
+      self._send_next()
+
+
+  def _eof(self):
+    """
+    The process has gone: fail all pending requests; later requests fail
+    at once.
+    """
+    if self.dispatcher is not None:
+      self.dispatcher.close()
+      self.dispatcher = None
+    self.error = 1
+    self.output = None
+    queue, self.queue = self.queue, []
+    for line, pending in queue:
+      if not pending.done: pending.resolve(False)
+
+
+  def _expire(self):
+    """
+    Fail the requests whose timeout has passed. Their entries stay queued
+    until their prompt arrives (Axiom is still working on them), so that
+    the following requests get their own output.
+    """
+    now = time.time()
+    for line, pending in list(self.queue):
+      if not pending.done and pending.deadline is not None and \
+        now >= pending.deadline:
+        self.error = 2
+        pending.resolve(False)
+
+
+  def _send_next(self):
+    """
+    Send the line of the first queued request (if any). If the process
+    has gone, all requests fail.
+    """
+    if self.queue and self.queue[0][0] is not None:
+      try:
+        self.axp.sendline(self.queue[0][0])
+      except (OSError, IOError):
+        self._eof()
+
+
+  def _enqueue(self, line, timeout = None):
+    """
+    Queue line and send it if nothing else is in progress. The request
+    fails after timeout seconds (default cfg.request_timeout).
+    """
+    if timeout is None: timeout = self.cfg.request_timeout
+    pending = Pending(timeout)
+    if self.dispatcher is not None and not self.isalive():
+      self._eof()
+    if self.dispatcher is None:
+      pending.resolve(False)
+      return pending
+    self.queue.append((line, pending))
+    if len(self.queue) == 1:
+      self._send_next()
+    return pending
+
+
+  def start(self, **kwargs):
+    """
+    Spawn Axiom (kwargs as in Axiom0.start) and return a Pending which is
+    resolved when the banner has been read and the commands in
+    cfg.cmd_init have been sent.
+    """
+    if self.axp is not None:
+      pending = Pending()
+      pending.resolve(self.isalive(), None, self.prompt)
+      return pending
+    self.axp = spawn(self.cfg.appname, **kwargs)
+    self.axp.delaybeforesend = self.cfg.delaybeforesend
+    self.dispatcher = _PtyDispatcher(self, self.axp.child_fd, self.map)
+    pending = self._enqueue(None)
+    for cmd in self.cfg.cmd_init:
+      pending = self._enqueue(cmd)
+    return pending
+
+
+  def stop(self):
+    """
+    Stop Axiom (the hard way) and fail all pending requests.
+    The return value is that of the isalive() function.
+    """
+    if self.dispatcher is not None:
+      self.dispatcher.close()
+      self.dispatcher = None
+    if self.axp is not None:
+      self.axp.close()
+      self.axp = None
+    self._eof()
+    self.error = None
+    return not self.isalive()
+
+
+  def isalive(self):
+    """
+    Check if Axiom is running.
+    """
+    if self.axp is not None:
+      return self.axp.isalive()
+    else:
+      return False
+
+
+  def busy(self):
+    """
+    True if requests are waiting for their prompt.
+    """
+    return len(self.queue) > 0
+
+
+  def writeln(self, src, timeout = None):
+    """
+    Queue a line (see Axiom0.writeln). Return a Pending instance, which
+    fails after timeout seconds (default cfg.request_timeout).
+    """
+    return self._enqueue(src, timeout)
+
+
+  def writef(self, filename, timeout = None):
+    """
+    Urge Axiom to read in the file. Return a Pending instance.
+    """
+    if os.path.isfile(filename):
+      return self.writeln(self.cfg.cmd_read_quiet.format(filename), timeout)
+    pending = Pending()
+    pending.resolve(False)
+    return pending
+
+
+  def write(self, src, timeout = None):
+    """
+    Multiline input via a temp file (see Axiom0.write), which is deleted
+    as soon as the request has been resolved (requests may be queued, so
+    the file is not reused; it is placed into cfg.inputdir though).
+    Return a Pending instance (see writeln).
+    """
+    tmpf = tempfile.NamedTemporaryFile(dir = self.cfg.inputdir,
+      **self.cfg.tmpfile_kw)
+    tmpf.write(src)
+    tmpf.close()
+    pending = self.writef(tmpf.name, timeout)
+    pending.add_callback(lambda p: os.unlink(tmpf.name))
+    return pending
+
+
 
 
 def main():
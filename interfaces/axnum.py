@@ -0,0 +1,327 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Module axnum:
+  - Bulk transfer of numeric Axiom values (List, Vector, Matrix of Integer,
+    Float, DoubleFloat, ...) from an Axiom0 session into NumPy arrays.
+  - Instead of pretty printing the value to the console, Axiom writes
+    unparse(convert(x)@InputForm) into a data file (fs.datadir, RAM-backed
+    if possible), which is parsed by a single numpy.fromstring call.
+  - scrape: numbers from the 2-D text output (the former way; for outputs
+    at hand, e.g. Axiom0.output).
+  - Evaluator: an expression (its InputForm) translated into a vectorized
+    NumPy function, cached per InputForm (evaluator, function), so that a
+    result is evaluated at many points in one call instead of one Axiom
+    round trip per point.
+
+  NumPy is optional for the other modules; this one requires it.
+
+  Usage:
+    ax = axiom.Axiom0(); ax.start()
+    a = array(ax, "m")     # m: Matrix DoubleFloat -> 2-D ndarray
+    b = loads("[1,2,3]", int)
+    f = function(ax, "D(sin(x)*exp(-y^2), x)", ['x', 'y'])
+    z = f(numpy.linspace(0, 1, 1000), 0.5)
+"""
+
+
+import os, os.path
+import re
+import tempfile
+import threading
+import __future__
+from collections import OrderedDict
+import axparse
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+# Defaults (factory settings) ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+class fs: pass
+fs.__doc__ = """axnum factory settings"""
+
+# Directory and names of the data files (None: system temp dir).
+if os.path.isdir('/dev/shm'):
+  fs.datadir = '/dev/shm'
+else:
+  fs.datadir = None
+fs.data_prefix = 'axnum_'
+fs.data_suffix = '.dat'
+
+# Axiom input (read by Axiom0.write) writing the InputForm of {1} into the
+# file {0}; the trailing semicolons suppress the output.
+fs.dump_tpl = """\
+axnum__f : TextFile := open("{0}"::FileName, "output");
+writeLine!(axnum__f, unparse(convert(({1}))@InputForm));
+close!(axnum__f);
+"""
+
+# Constructors and characters dropped before the numbers are parsed;
+# Float values appear as float(mantissa, exponent, base).
+fs.words = ['matrix', 'vector', 'float']
+fs.drop = "() \t\r\n"
+
+# Numbers in the 2-D output (scrape).
+fs.number_re = r"[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?"
+
+# Evaluator: tokens of the InputForm, Axiom functions -> NumPy functions
+# (see also _float, _nthroot), constants, maximal number of cached
+# evaluators.
+fs.token_re = r"\s*(?:(?P<num>[0-9]+\.?[0-9]*(?:[eE][-+]?[0-9]+)?)" \
+  r"|(?P<name>%?[a-zA-Z_][a-zA-Z0-9_]*)|(?P<op>[-+*/^(),]))"
+fs.functions = {'sin':'sin', 'cos':'cos', 'tan':'tan', 'asin':'arcsin',
+  'acos':'arccos', 'atan':'arctan', 'sinh':'sinh', 'cosh':'cosh',
+  'tanh':'tanh', 'asinh':'arcsinh', 'acosh':'arccosh', 'atanh':'arctanh',
+  'exp':'exp', 'log':'log', 'sqrt':'sqrt', 'abs':'abs'}
+fs.constants = {'%pi':'pi', '%e':'e', '%i':'1j'}
+fs.maxevaluators = 256
+
+fs.err_numpy = "axnum requires NumPy."
+fs.err_value = "Not a numeric list, vector or matrix: %s"
+fs.err_token = "Cannot translate the InputForm at: %s"
+fs.err_function = "No NumPy function for: %s"
+fs.err_variable = "Not in the variables: %s"
+
+
+def loads(text, dtype = None, cfg = fs()):
+  """
+  Parse the unparsed InputForm text of a numeric list or vector (1-D) or
+  matrix/list of lists (2-D), e.g. "matrix([[1.0,2.0],[3.0,4.0]])".
+  Return: an ndarray of dtype (default: float, int for integers). Raise
+  ValueError if the text is not of this form.
+  """
+  if numpy is None: raise ImportError(cfg.err_numpy)
+  s = text.strip()
+  for w in cfg.words:
+    s = s.replace(w, "")
+  s = s.translate(None, cfg.drop)
+  rows = 0
+  if s.startswith("[["): rows = s.count("],[") + 1
+  s = s.translate(None, "[]")
+  if not s: return numpy.zeros((rows, 0) if rows else 0, dtype or float)
+  isfloat = "float(" in text
+  if dtype is None:
+    if isfloat or "." in s or "e" in s or "E" in s:
+      dtype = float
+    else:
+      dtype = int
+  a = numpy.fromstring(s, isfloat and float or dtype, sep = ",")
+  if a.size != s.count(",") + 1 or (isfloat and a.size % 3):
+    raise ValueError(cfg.err_value % text[:60])
+  if isfloat:
+    a = a.reshape(-1, 3)
+    a = (a[:, 0] * a[:, 2] ** a[:, 1]).astype(dtype)
+  if rows:
+    if a.size % rows: raise ValueError(cfg.err_value % text[:60])
+    a = a.reshape(rows, -1)
+  return a
+
+
+def array(ax, expr, dtype = None, cfg = fs()):
+  """
+  Transfer the value of the Axiom expression expr (e.g. the name of a
+  Matrix DoubleFloat) of the Axiom0 session ax into an ndarray: Axiom
+  writes its InputForm into a data file which is parsed by loads.
+  Return: the ndarray or None if Axiom did not write the value (the
+  message is in ax.output). Raise ValueError as loads.
+  """
+  if numpy is None: raise ImportError(cfg.err_numpy)
+  text = inputform(ax, expr, cfg)
+  if text is None: return None
+  return loads(text, dtype, cfg)
+
+
+def inputform(ax, expr, cfg = fs()):
+  """
+  The unparsed InputForm of the value of expr in the Axiom0 session ax,
+  written by Axiom into a data file (cfg.dump_tpl). The dump is not
+  recorded (see Axiom0.write), so it does not invalidate cached results
+  and is not replayed when the session is restored.
+  Return: the text or None if Axiom did not write it.
+  """
+  fd, name = tempfile.mkstemp(cfg.data_suffix, cfg.data_prefix, cfg.datadir)
+  os.close(fd)
+  try:
+    if not ax.write(cfg.dump_tpl.format(name, expr), False): return None
+    f = open(name, 'rb')
+    text = f.read().strip()
+    f.close()
+  finally:
+    os.remove(name)
+  return text or None
+
+
+def scrape(output, dtype = float, cfg = fs()):
+  """
+  Extract the numbers of the value in the (2-D text) output of a command
+  (without the echoed input), one row per line for a Matrix type.
+  Return: an ndarray (1-D or 2-D).
+  """
+  if numpy is None: raise ImportError(cfg.err_numpy)
+  text, sep, typ = output.rpartition("Type:")
+  if not sep: text = output
+  text = re.sub(axparse.fs.label_re, "", text, 1, re.M)
+  text = re.sub(axparse.fs.continuation_re, "", text).replace("- ", "-")
+  rx = re.compile(cfg.number_re)
+  if typ.strip().startswith("Matrix"):
+    rows = [r for r in map(rx.findall, text.splitlines()) if r]
+    return numpy.array(rows, dtype)
+  return numpy.array(rx.findall(text), dtype)
+
+
+def _float(m, e, b):
+  """
+  Axiom's float(mantissa, exponent, base).
+  """
+  return m * float(b) ** e
+
+
+def _nthroot(x, n):
+  """
+  Axiom's nthRoot(x, n), real for negative x and odd n.
+  """
+  if n % 2: return numpy.sign(x) * numpy.abs(x) ** (1.0 / n)
+  return x ** (1.0 / n)
+
+
+#;;;;;;;;;;;;;;;;;;;;;
+# Class Evaluator ;;;
+#;;;;;;;;;;;;;;;;;;;;;
+class Evaluator():
+  """
+  The InputForm text of an expression (e.g. "sin(x)*exp(-y^2)") as a
+  NumPy function of its variables. The arguments (arrays or numbers) are
+  broadcast; integer arrays are evaluated as floats.
+  """
+  def __init__(self, text, variables = None, cfg = fs()):
+    """
+    variables: the names of the arguments in order, default: the free
+    variables of text, sorted. Raise ValueError if text contains anything
+    but numbers, variables, the operators + - * / ^, the functions in
+    cfg.functions, float, nthRoot and the constants in cfg.constants.
+    """
+    if numpy is None: raise ImportError(cfg.err_numpy)
+    self.text = text
+    names, expr = self.translate(text, cfg)
+    if variables is None: variables = sorted(names)
+    for v in names:
+      if v not in variables: raise ValueError(cfg.err_variable % v)
+    self.variables = list(variables)
+    args = ", ".join(["v%i" % i for i in range(len(self.variables))])
+    expr = re.sub(r"\{([^{}]*)\}",
+      lambda m: "v%i" % self.variables.index(m.group(1)), expr)
+    self.source = "lambda %s: %s" % (args, expr)
+    env = dict([(k, getattr(numpy, v)) for k, v in cfg.functions.items()])
+    env.update({'float':_float, 'nthRoot':_nthroot, 'pi':numpy.pi,
+      'e':numpy.e, '__builtins__':{}})
+    self.fn = eval(compile(self.source, '<axnum>', 'eval',
+      __future__.division.compiler_flag, True), env)
+
+
+  def translate(self, text, cfg = fs()):
+    """
+    Tokenize the InputForm text. Return: the variable names and the
+    Python expression (variables as {name}). The numbers become floats:
+    integers wider than 64 bit (rational and series coefficients) would
+    turn the arrays into object arrays.
+    """
+    rx = re.compile(cfg.token_re)
+    names = set()
+    out = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+      m = rx.match(text, pos)
+      if m is None: raise ValueError(cfg.err_token % text[pos:pos+20])
+      pos = m.end()
+      kind = m.lastgroup
+      t = m.group(kind)
+      if kind == 'op':
+        out.append(t == '^' and '**' or t)
+      elif kind == 'num':
+        out.append(repr(float(t)))
+      elif t in cfg.constants:
+        out.append(cfg.constants[t])
+      elif text[pos:].lstrip().startswith('('):
+        if not (t in cfg.functions or t in ('float', 'nthRoot')):
+          raise ValueError(cfg.err_function % t)
+        out.append(t)
+      elif t.startswith('%'):
+        raise ValueError(cfg.err_token % t)
+      else:
+        names.add(t)
+        out.append("{%s}" % t)
+    return names, " ".join(out)
+
+
+  def __call__(self, *args):
+    args = [numpy.asarray(a) for a in args]
+    args = [a.astype(float) if a.dtype.kind in 'biu' else a for a in args]
+    r = self.fn(*args)
+    if args and numpy.ndim(r) == 0:
+      r = numpy.full(numpy.broadcast(*args).shape, r)
+    return r
+
+
+  def __repr__(self):
+    return "<Evaluator %s>" % self.source
+
+
+# Evaluators by (InputForm, variables, translation settings), LRU.
+_evaluators = OrderedDict()
+_lock = threading.Lock()
+
+def evaluator(text, variables = None, cfg = fs()):
+  """
+  Return the (cached) Evaluator of the InputForm text.
+  """
+  k = (text, None if variables is None else tuple(variables),
+    cfg.token_re, tuple(sorted(cfg.functions.items())),
+    tuple(sorted(cfg.constants.items())))
+  _lock.acquire()
+  try:
+    ev = _evaluators.pop(k, None)
+    if ev is not None:
+      _evaluators[k] = ev
+      return ev
+  finally:
+    _lock.release()
+  ev = Evaluator(text, variables, cfg)
+  _lock.acquire()
+  try:
+    _evaluators[k] = ev
+    while len(_evaluators) > cfg.maxevaluators:
+      _evaluators.popitem(last = False)
+  finally:
+    _lock.release()
+  return ev
+
+
+def function(ax, expr, variables = None, cfg = fs()):
+  """
+  Transfer the InputForm of the expression expr from the Axiom0 session
+  ax (one round trip) and return its Evaluator (see evaluator), or None
+  if Axiom did not write it.
+  """
+  text = inputform(ax, expr, cfg)
+  if text is None: return None
+  return evaluator(text, variables, cfg)
+
+
+
+
+def main():
+  pass
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,407 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Module axparse:
+  - A single pass tokenizer for Axiom output: one scan over the output
+    yields the text segments (the output without the TeX fragments), the
+    TeX fragments (rewritten), the 'Type:' lines and the step index.
+  - The TeX rewriting (\\leqno, \\sp, \\sb, \\root ... \\of) is done by one
+    compiled pattern per fragment instead of one re.sub per rule.
+  - Parsers for TeXmacs/MathJax (tm), breqn (app_axiom) and no rewriting
+    (plain); used by tm_axiom, app_axiom and wax.py.
+  - Result: the compact record of one command (returned by Axiom0.writeln
+    and write if cfg.results is set), parsed on first access only.
+  - stream: incremental parsing of the output chunks as they arrive (e.g.
+    Axiom0.writeln_iter), for outputs too large to be held several times;
+    Parser.join_iter: the rewritten output chunk by chunk (wax.py /stream).
+
+  Usage:
+    p = tm.parse(output)
+    p.text, p.tex, p.types, p.index, p.join()
+    index, type, value = type_and_value(output)
+    for kind, data in stream(ax.writeln_iter(src)): ...
+"""
+
+
+import re
+import itertools
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+# Defaults (factory settings) ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+class fs: pass
+fs.__doc__ = """axparse factory settings"""
+
+# Tokens of the output: TeX fragments, type lines, step labels '(n)' at
+# the start of a line.
+fs.scan_re = r"(?P<tex>\$\$[^\$]*\$\$)|Type:(?P<type>[a-zA-Z0-9_. ]*)" \
+  r"|^[ \t]*\((?P<index>[0-9]+)\)"
+
+# TeX rewriting rules: name -> pattern. The replacement is given per
+# parser (see Parser), \leqno(n) also gives the step index.
+fs.rules = [
+  ('leqno', r"\\leqno\((?P<leqno>\d*)\)"),
+  ('sp', r"\\sp\s*(?P<sp>[^ \t\r\n\f\v\\]*)"),
+  ('sb', r"\\sb\s*(?P<sb>[^ \t\r\n\f\v\\]*)"),
+  ('root', r"\\root\s*(?P<root>\{\d*\})\s*\\of")]
+
+# Replacements (templates, %s: the captured group)
+fs.tm_subs = {'leqno':"", 'sp':"^{%s}", 'sb':"_{%s}", 'root':"\\sqrt[%s]"}
+fs.breqn_subs = {'leqno':"%"}
+
+fs.breqn_tpl = "\\begin{dmath*}\n%s\n\\end{dmath*}"
+
+# Step label of a result (at the start of a line), line continuation.
+fs.label_re = r"^[ \t]*\(([0-9]+)\)"
+fs.continuation_re = r"_\r?\n"
+
+# stream: TeX delimiter, type lines (the whole type).
+fs.tex_delim = "$$"
+fs.type_re = r"^[ \t]*Type:[ \t]*(.*\S)"
+
+
+#;;;;;;;;;;;;;;;;;;
+# Class Parsed ;;;
+#;;;;;;;;;;;;;;;;;;
+class Parsed():
+  """
+  The result of Parser.parse: text (segments between the TeX fragments,
+  len(text) == len(tex) + 1), tex (rewritten fragments), types and index
+  (the first step number found or None).
+  """
+  def __init__(self, text, tex, types, index):
+    self.text = text
+    self.tex = tex
+    self.types = types
+    self.index = index
+
+
+  def txt(self):
+    """
+    The output without the TeX fragments.
+    """
+    return "".join(self.text)
+
+
+  def join(self):
+    """
+    The output with the rewritten TeX fragments.
+    """
+    parts = [self.text[0]]
+    for t, s in zip(self.tex, self.text[1:]):
+      parts.append(t)
+      parts.append(s)
+    return "".join(parts)
+
+
+#;;;;;;;;;;;;;;;;;;
+# Class Parser ;;;
+#;;;;;;;;;;;;;;;;;;
+class Parser():
+  """
+  Tokenizer/rewriter. subs maps rule names (fs.rules) to replacement
+  templates, rules without replacement are left alone; each fragment is
+  put into the template tpl.
+  """
+  def __init__(self, subs = {}, tpl = "%s", cfg = fs()):
+    self.cfg = cfg
+    self.subs = subs
+    self.tpl = tpl
+    self.scan = re.compile(cfg.scan_re, re.M)
+    rules = [(n, p) for n, p in cfg.rules if n in subs or n == 'leqno']
+    self.rewriter = re.compile("|".join([p for n, p in rules]))
+
+
+  def rewrite(self, tex, found = None):
+    """
+    Apply the rules to the TeX fragment tex (one pass). The \\leqno
+    numbers are appended to the list found.
+    """
+    def sub(m):
+      name = m.lastgroup
+      if name == 'leqno' and found is not None:
+        found.append(m.group('leqno'))
+      if name not in self.subs: return m.group(0)
+      return self.subs[name].replace("%s", m.group(name))
+    return self.tpl % self.rewriter.sub(sub, tex)
+
+
+  def parse(self, data):
+    """
+    Scan data once. Return: a Parsed instance.
+    """
+    text = []
+    tex = []
+    types = []
+    index = None
+    leqno = []
+    pos = 0
+    for m in self.scan.finditer(data):
+      kind = m.lastgroup
+      if kind == 'tex':
+        text.append(data[pos:m.start()])
+        pos = m.end()
+        tex.append(self.rewrite(m.group(kind), leqno))
+      elif kind == 'type':
+        types.append(m.group(kind).strip())
+      elif index is None:
+        index = int(m.group(kind))
+    text.append(data[pos:])
+    if index is None and leqno and leqno[0]:
+      index = int(leqno[0])
+    return Parsed(text, tex, types, index)
+
+
+  def join_iter(self, chunks):
+    """
+    As parse(data).join() for the output given as an iterable of chunks,
+    incrementally: the text is yielded as it arrives, each TeX fragment
+    (rewritten) when it is complete; only an open fragment is buffered.
+    """
+    delim = self.cfg.tex_delim
+    n = len(delim)
+    buf = ""
+    # open fragment: its pieces (joined once it is complete) and the text
+    # after its opening delimiter that may hold the start of the closing one
+    frag = None
+    tail = ""
+    for chunk in itertools.chain(chunks, [None]):
+      if chunk is None:
+        if frag is not None: yield "".join(frag)
+        elif buf: yield buf
+        break
+      if frag is not None:
+        # only the new chunk is searched for the closing delimiter
+        s = tail + chunk
+        j = s.find(delim)
+        if j < 0:
+          frag.append(chunk)
+          tail = s[max(0, len(s) - n + 1):]
+          continue
+        k = j + n - len(tail)
+        frag.append(chunk[:k])
+        yield self.rewrite("".join(frag))
+        frag = None
+        buf = chunk[k:]
+      else:
+        buf += chunk
+      while buf:
+        i = buf.find(delim)
+        if i < 0:
+          # keep the start of a delimiter split between chunks
+          k = len(buf)
+          for m in range(min(n - 1, len(buf)), 0, -1):
+            if delim.startswith(buf[-m:]):
+              k -= m
+              break
+          if k: yield buf[:k]
+          buf = buf[k:]
+          break
+        j = buf.find(delim, i + n)
+        if j < 0:
+          if i: yield buf[:i]
+          frag = [buf[i:]]
+          tail = buf[max(i + n, len(buf) - n + 1):]
+          buf = ""
+          break
+        if i: yield buf[:i]
+        yield self.rewrite(buf[i:j+n])
+        buf = buf[j+n:]
+
+
+# TeXmacs/MathJax (standard LaTeX), breqn (dmath*), no rewriting.
+tm = Parser(fs.tm_subs)
+breqn = Parser(fs.breqn_subs, fs.breqn_tpl)
+plain = Parser()
+
+
+def type_and_value(output, cfg = fs()):
+  """
+  Get index, type and value in the (text) output: the value follows the
+  first step label (n) up to 'Type:', continued lines are joined. The
+  index (string) and the type are None if not found.
+  """
+  m = re.search(cfg.label_re, output, re.M)
+  r = output[m and m.end() or 0:].split("Type:", 1)
+  ri = m and m.group(1)
+  rv = re.sub(cfg.continuation_re, "", r[0].strip(" \r\n"))
+  rt = len(r) > 1 and r[1].split("\n", 1)[0].strip() or None
+  return ri, rt, rv
+
+
+def stream(chunks, cfg = fs()):
+  """
+  Parse the output given as an iterable of chunks (strings) incrementally.
+  Yield (kind, data) pairs in the order of the output:
+    ('index', n)      the step label (n) at the start of a line (n: int)
+    ('row', line)     a line of text, continued lines (ending with '_')
+                      joined, without the line end
+    ('tex', fragment) a TeX fragment $$...$$ (lines joined with newlines)
+    ('type', type)    the type of a result (the rest of a 'Type:' line)
+  Only the current line (or TeX fragment) is buffered, so the memory used
+  is bounded by the chunk size and the longest line, not by the size of
+  the output.
+  """
+  label = re.compile(cfg.label_re)
+  type_re = re.compile(cfg.type_re)
+  delim = cfg.tex_delim
+  tail = ""    # incomplete line
+  cont = []    # pieces of a continued line
+  tex = None   # lines of an open TeX fragment
+  for chunk in itertools.chain(chunks, [None]):
+    if chunk is None:
+      if not tail: break
+      lines = [tail]
+    else:
+      lines = (tail + chunk).split("\n")
+      tail = lines.pop()
+    for line in lines:
+      line = line.rstrip("\r")
+      if tex is not None:
+        tex.append(line)
+        if delim in line:
+          yield 'tex', "\n".join(tex)
+          tex = None
+        continue
+      if line.endswith("_"):
+        cont.append(line[:-1])
+        continue
+      if cont:
+        cont.append(line)
+        line = "".join(cont)
+        cont = []
+      s = line.lstrip()
+      if s.startswith(delim):
+        if s.count(delim) > 1:
+          yield 'tex', s
+        else:
+          tex = [line]
+        continue
+      m = type_re.match(line)
+      if m is not None:
+        yield 'type', m.group(1)
+        continue
+      m = label.match(line)
+      if m is not None:
+        yield 'index', int(m.group(1))
+      yield 'row', line
+  if cont:
+    yield 'row', "".join(cont)
+  if tex is not None:
+    yield 'tex', "\n".join(tex)
+
+
+#;;;;;;;;;;;;;;;;;;
+# Class Result ;;;
+#;;;;;;;;;;;;;;;;;;
+class Result(object):
+  """
+  The result of one command: the step index (prompt number when sent), the
+  elapsed time (seconds) and the span [start:end] of the raw output in data
+  (the output string, shared e.g. by the results of a batch). Types, value,
+  TeX and text are parsed on first access and memoized; __slots__ keeps
+  long histories small.
+  """
+  __slots__ = ('index', 'elapsed', 'data', 'start', 'end', '_parsed', '_tv')
+
+  # Parser of the TeX fragments (class attribute, may be overridden)
+  parser = plain
+
+  def __init__(self, data, index = None, elapsed = 0.0, start = 0, end = None):
+    self.index = index
+    self.elapsed = elapsed
+    self.data = data
+    self.start = start
+    if end is None: end = len(data)
+    self.end = end
+    self._parsed = None
+    self._tv = None
+
+
+  @property
+  def raw(self):
+    """
+    The output of the command (unmodified).
+    """
+    if self.start == 0 and self.end == len(self.data): return self.data
+    return self.data[self.start:self.end]
+
+
+  @property
+  def parsed(self):
+    """
+    The Parsed instance of the output (see parser).
+    """
+    if self._parsed is None: self._parsed = self.parser.parse(self.raw)
+    return self._parsed
+
+
+  @property
+  def types(self):
+    return self.parsed.types
+
+
+  @property
+  def type(self):
+    """
+    The type of the result (the whole 'Type:' line) or None.
+    """
+    return self.tv[1]
+
+
+  @property
+  def tex(self):
+    return self.parsed.tex
+
+
+  @property
+  def text(self):
+    """
+    The output without the TeX fragments.
+    """
+    return self.parsed.txt()
+
+
+  @property
+  def tv(self):
+    """
+    Index, type and value (type_and_value of the text).
+    """
+    if self._tv is None: self._tv = type_and_value(self.text)
+    return self._tv
+
+
+  @property
+  def value(self):
+    """
+    The value of the result (text, continued lines joined).
+    """
+    return self.tv[2]
+
+
+  def __len__(self):
+    return self.end - self.start
+
+
+  def __nonzero__(self):
+    return True
+
+
+  def __repr__(self):
+    return "<Result (%s) %s, %.1f ms, %i bytes>" % (self.index, self.type,
+      self.elapsed * 1e3, len(self))
+
+
+
+
+def main():
+  pass
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,248 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Module memo:
+  - ResultCache: a size-bounded (LRU) cache of Axiom outputs, keyed by the
+    normalized input and a fingerprint of the session state, which may be
+    shared by many Axiom0 instances (threads) and saved to a file.
+
+  Usage:
+    cfg = axiom.fs()
+    cfg.cache = ResultCache()
+    ax = Axiom0(cfg)   # writeln/write now look into cfg.cache first
+
+  Inputs which define or change state (assignments, declarations, system
+  commands, destructive operations, references to previous results, ...)
+  are never cached; instead they are folded into the session fingerprint
+  (Axiom0.fingerprint), so that a cached output is only reused by sessions
+  with the same settings, loaded files and definitions.
+"""
+
+
+import re
+import hashlib
+import threading
+import cPickle
+from collections import OrderedDict
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+# Defaults (factory settings) ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+class fs: pass
+fs.__doc__ = """memo factory settings"""
+
+# Maximal number of cached outputs.
+fs.maxsize = 1000
+
+# File the cache is loaded from (at creation) and saved to (save), or None.
+fs.filename = None
+
+# Inputs matching one of these patterns are not cached.
+fs.impure_re = [
+  r"(?m)^\s*\)",            # system commands ()set, )read, )clear ...)
+  r":=|==|=>",              # assignments, definitions, macros, exits
+  r"(?<!:):(?![:=])",       # declarations x : T
+  r"%(?![a-zA-Z])",         # %, %%(n): previous results
+  r"!",                     # destructive operations (setelt!, ...)
+  r"\b(random|seed|open|close!?|readLine!?|writeLine!?)\b"]
+
+# Outputs matching this pattern (error messages) are not cached.
+fs.error_re = r"(?i)\berror\b|Cannot find a definition|There are no library"
+
+# Step number labels in the output (at the start of a line, \leqno in TeX
+# output), renumbered when a cached output is used. Other parenthesized
+# numbers belong to the value and are left alone.
+fs.label_re = r"(?m)^[ \t]*\(([0-9]+)\)|\\leqno\(([0-9]+)\)"
+
+
+def ispure(src, cfg = fs()):
+  """
+  True if src matches none of the cfg.impure_re patterns, i.e. it does not
+  seem to define or change any state.
+  """
+  for p in cfg.impure_re:
+    if re.search(p, src): return False
+  return True
+
+
+def iserror(output, cfg = fs()):
+  """
+  True if output matches cfg.error_re (an error message).
+  """
+  return re.search(cfg.error_re, output) is not None
+
+
+def normalize(src):
+  """
+  Drop empty lines, trailing blanks and repeated blanks within a line
+  (the indentation is kept, it matters for piles).
+  """
+  lines = [re.sub(r"(?<=\S)[ \t]+", " ", l.rstrip())
+    for l in src.strip().splitlines() if l.strip()]
+  return "\n".join(lines)
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;
+# Class ResultCache ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;
+class ResultCache():
+  """
+  LRU cache: key -> (step number, output, number of steps).
+  """
+
+  def __init__(self, cfg = fs()):
+    """
+    The argument cfg has to be an instance of the factory settings.
+    """
+    self.cfg = cfg
+    self.impure = [re.compile(p) for p in cfg.impure_re]
+    self.error = re.compile(cfg.error_re)
+    self.items = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    if cfg.filename is not None:
+      self.load(cfg.filename)
+
+
+  def normalize(self, src):
+    """
+    See normalize (module function).
+    """
+    return normalize(src)
+
+
+  def cacheable(self, src):
+    """
+    True if src looks like a pure expression.
+    """
+    for rx in self.impure:
+      if rx.search(src): return False
+    return True
+
+
+  def key(self, src, fingerprint, method = ""):
+    """
+    The cache key of src evaluated by method (e.g. 'writeln', 'write') in a
+    session with the fingerprint.
+    """
+    return hashlib.sha1(fingerprint + "\0" + method + "\0" +
+      self.normalize(src)).hexdigest()
+
+
+  def get(self, key, index = None):
+    """
+    Return the cached output (or None). If index is given, step number
+    labels are changed to start at index.
+    """
+    return self.fetch(key, index)[0]
+
+
+  def fetch(self, key, index = None):
+    """
+    As get, but return the output and the number of steps it took, or
+    (None, 0).
+    """
+    self.lock.acquire()
+    try:
+      item = self.items.pop(key, None)
+      if item is None:
+        self.misses += 1
+        return None, 0
+      self.items[key] = item
+      self.hits += 1
+    finally:
+      self.lock.release()
+    n, output, steps = item
+    if index is not None and n is not None and n != index:
+      def label(m):
+        g = m.lastindex
+        k = int(m.group(g))
+        if not n <= k < n + max(steps, 1): return m.group(0)
+        s, i, j = m.group(0), m.start(g) - m.start(), m.end(g) - m.start()
+        return s[:i] + str(k - n + index) + s[j:]
+      output = re.sub(self.cfg.label_re, label, output)
+    return output, steps
+
+
+  def put(self, key, output, index = None, steps = 1):
+    """
+    Store output (produced at step index, taking steps steps), unless it
+    contains errors. Return True if stored.
+    """
+    if output is None or self.error.search(output): return False
+    self.lock.acquire()
+    try:
+      self.items.pop(key, None)
+      self.items[key] = (index, output, steps)
+      while len(self.items) > self.cfg.maxsize:
+        self.items.popitem(last = False)
+    finally:
+      self.lock.release()
+    return True
+
+
+  def clear(self):
+    """
+    Remove all entries and reset the counters.
+    """
+    self.lock.acquire()
+    self.items.clear()
+    self.hits = self.misses = 0
+    self.lock.release()
+
+
+  def save(self, filename = None):
+    """
+    Save the entries (pickle) to filename (default: cfg.filename).
+    """
+    if filename is None: filename = self.cfg.filename
+    self.lock.acquire()
+    try:
+      items = self.items.items()
+    finally:
+      self.lock.release()
+    f = open(filename, 'wb')
+    cPickle.dump(items, f, cPickle.HIGHEST_PROTOCOL)
+    f.close()
+    return True
+
+
+  def load(self, filename = None):
+    """
+    Add the entries saved in filename (missing file: nothing happens).
+    """
+    if filename is None: filename = self.cfg.filename
+    try:
+      f = open(filename, 'rb')
+    except IOError:
+      return False
+    try:
+      items = cPickle.load(f)
+    finally:
+      f.close()
+    for key, item in items:
+      self.put(key, item[1], item[0], *item[2:])
+    return True
+
+
+  def stats(self):
+    """
+    Return size, hits and misses.
+    """
+    return {'size':len(self.items), 'hits':self.hits, 'misses':self.misses}
+
+
+
+
+def main():
+  pass
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,393 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Module pool:
+  - A pool of warm Axiom0 processes (banner read, cmd_init sent) shared
+    by the sessions of a web application.
+  - Each session id is bound to its own process (affinity) until the
+    session is released. Whenever a spare is handed out a new one is
+    spawned in the background, so that a new session never has to wait
+    for Axiom to start.
+  - Sessions idle for more than fs.idle_timeout seconds are hibernated:
+    the journal of their state changing inputs (Axiom0.journal) is saved
+    to a file and the process is stopped. The next acquire restores the
+    session into a spare by reading the journal in.
+
+  Usage:
+    pool = AxiomPool()
+    pool.start()
+    ax = pool.acquire(sid)
+    pool.lock(sid).acquire(); ax.writeln(...); pool.lock(sid).release()
+    pool.release(sid)
+    pool.stop()
+"""
+
+
+import os, os.path
+import time
+import tempfile
+import threading
+
+from axiom import Axiom0
+import axiom
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+# Defaults (factory settings) ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+class fs: pass
+fs.__doc__ = """pool factory settings"""
+
+# Number of warm spare processes kept ready.
+fs.size = 2
+
+# Configuration (axiom.fs instance) used for every Axiom0 of the pool
+# (the journal is needed to hibernate sessions).
+fs.axiom_cfg = axiom.fs()
+fs.axiom_cfg.journal = True
+# No result cache: notebook inputs refer to previous results (%, %%(n)),
+# which are not set by a cache hit (see axiom.fs.cache).
+fs.axiom_cfg.cache = None
+
+# Keywords passed to Axiom0.start (see pexpect spawn).
+fs.start_kw = {}
+
+# Seconds acquire waits for a spare before giving up (None: forever).
+fs.acquire_timeout = 120
+
+# Hibernate sessions idle for more than idle_timeout seconds (None: never),
+# checked every reap_interval seconds. The journals are written to
+# hibernate_dir (None: system temp dir).
+fs.idle_timeout = 1800
+fs.reap_interval = 60
+fs.hibernate_dir = None
+
+
+#;;;;;;;;;;;;;;;;;;;;
+# Class AxiomPool ;;;
+#;;;;;;;;;;;;;;;;;;;;
+class AxiomPool():
+  """
+  Keep cfg.size started Axiom0 instances in reserve and assign them to
+  session ids.
+  """
+
+  def __init__(self, cfg = fs()):
+    """
+    The argument cfg has to be an instance of the factory settings.
+    """
+    self.cfg = cfg
+
+    # Started, unassigned processes
+    self.spares = []
+
+    # Session id -> Axiom0
+    self.sessions = {}
+
+    # Session id -> Lock (serializes the requests of a session)
+    self.locks = {}
+
+    # Number of processes being spawned right now
+    self.spawning = 0
+
+    # Session id -> time of the last acquire
+    self.last_used = {}
+
+    # Session id -> (journal file, journal, fingerprint) of hibernated
+    # sessions
+    self.hibernated = {}
+
+    # Guards all of the above
+    self.cond = threading.Condition()
+
+    # False after stop has been called
+    self.running = False
+
+
+  def _spawn(self):
+    """
+    Start a new Axiom0 (runs in a background thread) and put it into
+    the spare list.
+    """
+    ax = Axiom0(self.cfg.axiom_cfg)
+    try:
+      ok = ax.start(**self.cfg.start_kw)
+    except Exception:
+      ok = False
+    self.cond.acquire()
+    try:
+      self.spawning -= 1
+      if ok and self.running:
+        self.spares.append(ax)
+      else:
+        ax.stop()
+      self.cond.notifyAll()
+    finally:
+      self.cond.release()
+
+
+  def _refill(self):
+    """
+    Spawn as many processes as needed to have cfg.size spares. The caller
+    must hold self.cond.
+    """
+    while self.running and len(self.spares) + self.spawning < self.cfg.size:
+      self.spawning += 1
+      t = threading.Thread(target = self._spawn)
+      t.daemon = True
+      t.start()
+
+
+  def start(self):
+    """
+    Start filling the pool (returns immediately).
+    """
+    self.cond.acquire()
+    try:
+      self.running = True
+      self._refill()
+    finally:
+      self.cond.release()
+    if self.cfg.idle_timeout is not None:
+      t = threading.Thread(target = self._reaper)
+      t.daemon = True
+      t.start()
+
+
+  def stop(self):
+    """
+    Stop all spare and assigned processes.
+    """
+    self.cond.acquire()
+    try:
+      self.running = False
+      procs = self.spares + self.sessions.values()
+      files = [h[0] for h in self.hibernated.values()]
+      self.spares = []
+      self.sessions.clear()
+      self.locks.clear()
+      self.last_used.clear()
+      self.hibernated.clear()
+      self.cond.notifyAll()
+    finally:
+      self.cond.release()
+    for ax in procs:
+      ax.stop()
+    for f in files:
+      self._remove(f)
+
+
+  def acquire(self, sid):
+    """
+    Return the Axiom0 instance bound to the session id sid. A session
+    without (living) process gets a spare, which is replaced by a fresh
+    one in the background; a hibernated session is restored into it.
+    Return None if no process became available within cfg.acquire_timeout
+    seconds or the restore failed (the session stays hibernated).
+    """
+    self.cond.acquire()
+    try:
+      self.last_used[sid] = time.time()
+      ax = self.sessions.get(sid)
+      if ax is not None:
+        if ax.isalive():
+          return ax
+        del self.sessions[sid]
+        ax.stop()
+      ax = self._take_spare()
+      if ax is None:
+        return None
+      self.sessions[sid] = ax
+      lock = self.locks.setdefault(sid, threading.Lock())
+      restore = self.hibernated.pop(sid, None)
+      if restore is not None:
+        lock.acquire() # until restored
+    finally:
+      self.cond.release()
+    if restore is not None:
+      try:
+        if not self._restore(ax, *restore):
+          self._failed(sid, ax, restore)
+          return None
+      finally:
+        lock.release()
+    return ax
+
+
+  def _take_spare(self):
+    """
+    Pop a living spare, waiting at most cfg.acquire_timeout seconds. The
+    caller must hold self.cond.
+    """
+    if self.cfg.acquire_timeout is not None:
+      deadline = time.time() + self.cfg.acquire_timeout
+    while self.running:
+      while self.spares:
+        ax = self.spares.pop(0)
+        if ax.isalive():
+          self._refill()
+          return ax
+        ax.stop()
+      self._refill()
+      if self.cfg.acquire_timeout is None:
+        self.cond.wait()
+      else:
+        remaining = deadline - time.time()
+        if remaining <= 0: return None
+        self.cond.wait(remaining)
+    return None
+
+
+  def _restore(self, ax, filename, journal, fingerprint):
+    """
+    Replay the journal file of a hibernated session in ax. Return False if
+    the replay failed (timeout, EOF, interrupt); the file is kept then.
+    """
+    if journal:
+      if not ax.writef(filename) or ax.interrupted: return False
+      ax.output = None
+    ax.journal = journal
+    ax.fingerprint = fingerprint
+    self._remove(filename)
+    return True
+
+
+  def _failed(self, sid, ax, restore):
+    """
+    The restore of the session sid into ax failed: stop ax and keep the
+    session hibernated (journal file and record), so that the next acquire
+    tries again.
+    """
+    self.cond.acquire()
+    try:
+      if self.sessions.get(sid) is ax: del self.sessions[sid]
+      self.hibernated.setdefault(sid, restore)
+    finally:
+      self.cond.release()
+    ax.stop()
+
+
+  def _remove(self, filename):
+    try:
+      os.unlink(filename)
+    except OSError:
+      pass
+
+
+  def hibernate(self, sid, idle = None):
+    """
+    Save the journal of the session sid to a file and stop its process.
+    The session is restored by the next acquire(sid). Return False if the
+    session has no process or is busy, or, if idle is given, has been
+    acquired within the last idle seconds (checked under the session
+    lock, so that a process just handed out by acquire is not stopped).
+    """
+    self.cond.acquire()
+    try:
+      ax = self.sessions.get(sid)
+      lock = self.locks.get(sid)
+      if ax is None or ax.journal is None: return False
+      if lock is not None and not lock.acquire(False): return False
+      try:
+        if idle is not None and \
+          time.time() - self.last_used.get(sid, 0) <= idle:
+          return False
+        fd, filename = tempfile.mkstemp('.input', 'wax$hib_',
+          self.cfg.hibernate_dir)
+        f = os.fdopen(fd, 'w')
+        f.write("\n".join(ax.journal) + "\n")
+        f.close()
+        self.hibernated[sid] = (filename, ax.journal, ax.fingerprint)
+        del self.sessions[sid]
+      finally:
+        if lock is not None: lock.release()
+    finally:
+      self.cond.release()
+    ax.stop()
+    return True
+
+
+  def _reaper(self):
+    """
+    Hibernate idle sessions (runs in a background thread).
+    """
+    while self.running:
+      time.sleep(self.cfg.reap_interval)
+      now = time.time()
+      self.cond.acquire()
+      try:
+        idle = [sid for sid in self.sessions
+          if now - self.last_used.get(sid, now) > self.cfg.idle_timeout]
+      finally:
+        self.cond.release()
+      for sid in idle:
+        self.hibernate(sid, self.cfg.idle_timeout)
+
+
+  def get(self, sid):
+    """
+    Return the Axiom0 instance bound to sid or None (no spare is assigned).
+    """
+    self.cond.acquire()
+    try:
+      return self.sessions.get(sid)
+    finally:
+      self.cond.release()
+
+
+  def lock(self, sid):
+    """
+    Return the lock of the session sid (create it if necessary). Hold it
+    while talking to the session's Axiom0 instance.
+    """
+    self.cond.acquire()
+    try:
+      return self.locks.setdefault(sid, threading.Lock())
+    finally:
+      self.cond.release()
+
+
+  def release(self, sid):
+    """
+    Stop the process bound to sid and forget the session.
+    """
+    self.cond.acquire()
+    try:
+      ax = self.sessions.pop(sid, None)
+      self.locks.pop(sid, None)
+      self.last_used.pop(sid, None)
+      restore = self.hibernated.pop(sid, None)
+      self._refill()
+    finally:
+      self.cond.release()
+    if ax is not None:
+      ax.stop()
+    if restore is not None:
+      self._remove(restore[0])
+
+
+  def stats(self):
+    """
+    Return the number of spares, sessions, hibernated sessions and
+    processes being spawned.
+    """
+    self.cond.acquire()
+    try:
+      return {'spares':len(self.spares), 'sessions':len(self.sessions),
+        'hibernated':len(self.hibernated), 'spawning':self.spawning}
+    finally:
+      self.cond.release()
+
+
+
+
+def main():
+  pass
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,398 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Module texcache:
+  - A content addressed cache for rendered images (PNG or SVG), shared by
+    texprt.TeX, app_latex.TeX and app_latex.tex2png.
+  - The key is a hash of the TeX source and of every setting that changes
+    the image (preamble, font size, resolution, colors, offset, ...), see
+    key().
+  - Entries are stored by key and image format ('png', 'svg'), so that a
+    key never yields an image of another format.
+  - Two tiers: an in-memory LRU (fs.maxitems, fs.maxbytes) and a private
+    per user directory on disk (fs.cachedir, bounded by fs.maxdiskbytes,
+    oldest files are evicted first). Entries found on disk are promoted to
+    memory.
+  - SingleFlight: concurrent renders of the same key run only once, the
+    other callers wait for the result.
+
+  Usage:
+    k = key(src, cfg.preamble, cfg.fontsize, ...)
+    png = cache.get(k)
+    if png is None: png = render(...); cache.put(k, png)
+    svg = cache.get(k, 'svg')
+"""
+
+
+import os, os.path
+import stat
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+# Defaults (factory settings) ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+class fs: pass
+fs.__doc__ = """texcache factory settings"""
+
+# Memory tier: maximal number of images and bytes.
+fs.maxitems = 1000
+fs.maxbytes = 32 * 2**20
+
+# Per user cache directory ($XDG_CACHE_HOME/wax or ~/.cache/wax).
+fs.userdir = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+  os.path.join(os.path.expanduser('~'), '.cache'), 'wax')
+
+# Disk tier: directory (None: no disk tier, it must be private, see
+# private) and maximal bytes. When the limit is exceeded the oldest files
+# are removed down to lowater * limit.
+fs.cachedir = os.path.join(fs.userdir, 'texcache')
+fs.maxdiskbytes = 256 * 2**20
+fs.lowater = 0.9
+
+# Image formats, the suffixes of the cache files.
+fs.formats = ['png', 'svg']
+
+
+def key(*parts):
+  """
+  The cache key (hex digest) of the parts (strings, numbers, None).
+  """
+  h = hashlib.sha1()
+  for p in parts:
+    p = str(p)
+    h.update("%i:" % len(p))
+    h.update(p)
+  return h.hexdigest()
+
+
+def private(d):
+  """
+  Create the directory d (mode 0700) if it does not exist and check that
+  it is a directory (not a link) owned by the current user and closed to
+  others, so that nobody else can plant files in it.
+  Return: d or None if it cannot be used.
+  """
+  try:
+    if not os.path.isdir(d): os.makedirs(d, 0700)
+  except OSError:
+    pass
+  try:
+    st = os.lstat(d)
+  except OSError:
+    return None
+  if not stat.S_ISDIR(st.st_mode): return None
+  if hasattr(os, 'getuid'):
+    if st.st_uid != os.getuid() or st.st_mode & 077: return None
+  return d
+
+
+def svgcolor(color):
+  """
+  The dvipng color color (a dvips name such as 'Blue', 'rgb r g b',
+  'RGB R G B', 'gray g' or 'cmyk c m y k') as SVG color.
+  """
+  w = color.split()
+  try:
+    if w[0] == 'rgb':
+      rgb = [float(x) for x in w[1:4]]
+    elif w[0] == 'RGB':
+      rgb = [float(x) / 255 for x in w[1:4]]
+    elif w[0] == 'gray':
+      rgb = [float(w[1])] * 3
+    elif w[0] == 'cmyk':
+      c, m, y, k = [float(x) for x in w[1:5]]
+      rgb = [(1 - c) * (1 - k), (1 - m) * (1 - k), (1 - y) * (1 - k)]
+    else:
+      return color.lower()
+  except (ValueError, IndexError):
+    return None
+  return "#%02x%02x%02x" % tuple([int(round(255 * x)) for x in rgb])
+
+
+def colorize(svg, color):
+  """
+  Set the default fill color of the SVG image svg (the glyphs and rules
+  dvisvgm writes without color) to the dvipng color color; dvisvgm has no
+  option like dvipng's -fg.
+  Return: the SVG image.
+  """
+  c = color and svgcolor(color)
+  if not c: return svg
+  return svg.replace("<svg", '<svg fill="%s"' % c, 1)
+
+
+#;;;;;;;;;;;;;;;;;;;;
+# Class PNGCache ;;;
+#;;;;;;;;;;;;;;;;;;;;
+class PNGCache():
+  """
+  Two tier (memory LRU, disk) cache: key, format -> image bytes.
+  """
+
+  def __init__(self, cfg = fs()):
+    """
+    The argument cfg has to be an instance of the factory settings.
+    """
+    self.cfg = cfg
+    self.items = OrderedDict()
+    self.nbytes = 0
+    self.diskbytes = None # computed on first use
+    self.diskdir = False # checked on first use, see dir()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.diskhits = 0
+    self.misses = 0
+
+
+  def dir(self):
+    """
+    The directory of the disk tier, created and checked on first use (see
+    private). Return None if there is no (usable) disk tier.
+    """
+    if self.diskdir is False:
+      self.diskdir = self.cfg.cachedir and private(self.cfg.cachedir) or None
+    return self.diskdir
+
+
+  def path(self, k):
+    """
+    The file name of the entry k (key.format) in the disk tier (or None).
+    """
+    d = self.dir()
+    if d is None: return None
+    return os.path.join(d, k)
+
+
+  def _remember(self, k, data):
+    """
+    Put data into the memory tier and evict. Caller holds the lock.
+    """
+    old = self.items.pop(k, None)
+    if old is not None: self.nbytes -= len(old)
+    self.items[k] = data
+    self.nbytes += len(data)
+    while self.items and (len(self.items) > self.cfg.maxitems or
+      self.nbytes > self.cfg.maxbytes):
+      k0, d0 = self.items.popitem(last = False)
+      self.nbytes -= len(d0)
+
+
+  def get(self, k, fmt = 'png'):
+    """
+    Return the image of the format fmt stored under k or None.
+    """
+    k = k + '.' + fmt
+    self.lock.acquire()
+    try:
+      data = self.items.pop(k, None)
+      if data is not None:
+        self.items[k] = data
+        self.hits += 1
+        return data
+    finally:
+      self.lock.release()
+    p = self.path(k)
+    if p is not None:
+      try:
+        f = open(p, 'rb')
+        data = f.read()
+        f.close()
+        os.utime(p, None) # eviction removes the least recently used
+      except (IOError, OSError):
+        data = None
+    self.lock.acquire()
+    try:
+      if data is None:
+        self.misses += 1
+      else:
+        self.diskhits += 1
+        self._remember(k, data)
+    finally:
+      self.lock.release()
+    return data
+
+
+  def put(self, k, data, fmt = 'png'):
+    """
+    Store the image data of the format fmt under k (both tiers).
+    """
+    if data is None: return False
+    k = k + '.' + fmt
+    self.lock.acquire()
+    try:
+      self._remember(k, data)
+    finally:
+      self.lock.release()
+    p = self.path(k)
+    if p is not None and not os.path.exists(p):
+      self._write(p, data)
+    return True
+
+
+  def _write(self, p, data):
+    """
+    Write the file p atomically (other processes may share the directory)
+    and keep the disk tier below cfg.maxdiskbytes.
+    """
+    try:
+      fd, tmp = tempfile.mkstemp('.tmp', 'put_', self.dir())
+      f = os.fdopen(fd, 'wb')
+      f.write(data)
+      f.close()
+      os.rename(tmp, p)
+    except (IOError, OSError):
+      return
+    self.lock.acquire()
+    try:
+      if self.diskbytes is None:
+        self.diskbytes = self._disksize()
+      else:
+        self.diskbytes += len(data)
+      if self.diskbytes > self.cfg.maxdiskbytes:
+        self._evict()
+    finally:
+      self.lock.release()
+
+
+  def _files(self):
+    """
+    (mtime, size, name) of the files of the disk tier.
+    """
+    files = []
+    d = self.dir()
+    for name in os.listdir(d):
+      if os.path.splitext(name)[1][1:] not in self.cfg.formats: continue
+      try:
+        st = os.stat(os.path.join(d, name))
+      except OSError:
+        continue
+      files.append((st.st_mtime, st.st_size, name))
+    return files
+
+
+  def _disksize(self):
+    return sum([f[1] for f in self._files()])
+
+
+  def _evict(self):
+    """
+    Remove the oldest files down to lowater * maxdiskbytes. Caller holds
+    the lock.
+    """
+    files = self._files()
+    files.sort()
+    total = sum([f[1] for f in files])
+    limit = self.cfg.lowater * self.cfg.maxdiskbytes
+    for mtime, size, name in files:
+      if total <= limit: break
+      try:
+        os.remove(os.path.join(self.dir(), name))
+        total -= size
+      except OSError:
+        pass
+    self.diskbytes = total
+
+
+  def clear(self, disk = False):
+    """
+    Empty the memory tier (and the disk tier if disk = True).
+    """
+    self.lock.acquire()
+    try:
+      self.items.clear()
+      self.nbytes = 0
+      self.hits = self.diskhits = self.misses = 0
+      if disk and self.dir() is not None:
+        for mtime, size, name in self._files():
+          try:
+            os.remove(os.path.join(self.dir(), name))
+          except OSError:
+            pass
+        self.diskbytes = 0
+    finally:
+      self.lock.release()
+
+
+  def stats(self):
+    """
+    Return entries, bytes and hit counters.
+    """
+    return {'items':len(self.items), 'bytes':self.nbytes,
+      'diskbytes':self.diskbytes, 'hits':self.hits,
+      'diskhits':self.diskhits, 'misses':self.misses}
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;
+# Class SingleFlight ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;
+class _Call():
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+
+
+class SingleFlight():
+  """
+  Coalesce concurrent calls with the same key: the first caller runs the
+  function, the others block until it is done and get the same result.
+  """
+
+  def __init__(self):
+    self.calls = {}
+    self.lock = threading.Lock()
+    self.runs = 0
+    self.saved = 0
+
+
+  def do(self, k, fn):
+    """
+    Return fn() or, if a call with key k is in flight, its result.
+    """
+    self.lock.acquire()
+    call = self.calls.get(k)
+    if call is not None:
+      self.saved += 1
+      self.lock.release()
+      call.done.wait()
+      return call.result
+    call = self.calls[k] = _Call()
+    self.runs += 1
+    self.lock.release()
+    try:
+      call.result = fn()
+    finally:
+      self.lock.acquire()
+      del self.calls[k]
+      self.lock.release()
+      call.done.set()
+    return call.result
+
+
+  def stats(self):
+    """
+    Return the calls in flight, the calls run and the calls saved.
+    """
+    return {'inflight':len(self.calls), 'runs':self.runs, 'saved':self.saved}
+
+
+# The cache and the in flight renders shared by the renderers.
+cache = PNGCache()
+flights = SingleFlight()
+
+
+
+
+def main():
+  pass
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,187 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Module texfmt:
+  - Precompiled LaTeX formats, one per distinct preamble (the part of a
+    document before \\begin{document}), so that latex does not parse the
+    document class and packages (breqn, amsmath, ...) on every render.
+  - A format is built once (latex -ini, preamble, \\dump) and stored in
+    fs.fmtdir (private per user, see texcache.private) under a hash of the
+    latex command, its version and the preamble; other processes of the
+    user reuse it.
+  - A format latex rejects (e.g. after a TeX update in a running process)
+    is removed (see rejected); the caller runs latex without it.
+
+  Usage:
+    header, body = split(document)
+    fmt = get(header, 'latex')
+    if fmt is None: run "latex" with document
+    else: run "latex -fmt=<fmt>" with body
+"""
+
+
+import os, os.path
+import re
+import hashlib
+import shutil
+import tempfile
+import threading
+from subprocess import Popen, PIPE
+import texcache
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+# Defaults (factory settings) ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+class fs: pass
+fs.__doc__ = """texfmt factory settings"""
+
+# Directory of the formats (must be private, latex loads them).
+fs.fmtdir = os.path.join(texcache.fs.userdir, 'texfmt')
+
+# The document starts here, everything before goes into the format.
+fs.begin = r"\begin{document}"
+
+# Command building the format {1}.fmt from the file {2} (in the cwd).
+fs.dumpcmd = r'{0} -ini -halt-on-error -interaction=nonstopmode -jobname={1} "&latex" {2}'
+fs.dump = "\n\\dump\n"
+
+# Command printing the version of latex {0} (first line used).
+fs.versioncmd = '{0} --version'
+
+# latex output when a format is not accepted.
+fs.rejected_re = r"Fatal format file error|---! .*\.fmt"
+
+
+# Serializes builds; preambles which failed to build or whose format was
+# rejected (not tried again); versions by latex command.
+_lock = threading.Lock()
+_failed = set()
+_versions = {}
+
+
+def split(doc, cfg = fs()):
+  """
+  Split the document doc into the preamble and the body (starting with
+  \\begin{document}). The preamble is None if there is no body.
+  """
+  i = doc.find(cfg.begin)
+  if i < 0: return None, doc
+  return doc[:i], doc[i:]
+
+
+def version(latex = 'latex', cfg = fs()):
+  """
+  The first line of the version output of latex (engine and TeX release),
+  determined once per process, '' if it cannot be run.
+  """
+  v = _versions.get(latex)
+  if v is None:
+    try:
+      p = Popen(cfg.versioncmd.format(latex), shell = True, stdin = PIPE,
+        stdout = PIPE, stderr = PIPE)
+      v = p.communicate()[0].strip().split("\n")[0].strip()
+    except OSError:
+      v = ''
+    _versions[latex] = v
+  return v
+
+
+def name(header, latex = 'latex'):
+  """
+  The (file) name of the format of header built with latex (and its
+  version, so that a TeX update builds new formats).
+  """
+  return 'fmt_' + hashlib.sha1(latex + "\0" + version(latex) + "\0" +
+    header).hexdigest()
+
+
+def get(header, latex = 'latex', cfg = fs()):
+  """
+  Return the path (without .fmt) of the format for header, build it if
+  it does not exist yet. Return None if the format cannot be built.
+  """
+  d = texcache.private(cfg.fmtdir)
+  if d is None: return None
+  n = name(header, latex)
+  path = os.path.join(d, n)
+  if n in _failed: return None
+  if os.path.exists(path + '.fmt'): return path
+  _lock.acquire()
+  try:
+    if os.path.exists(path + '.fmt'): return path
+    if build(header, latex, path, cfg): return path
+    _failed.add(n)
+    return None
+  finally:
+    _lock.release()
+
+
+def build(header, latex, path, cfg = fs()):
+  """
+  Dump the format path.fmt: header is read by latex -ini in a private
+  directory, the format is then moved to path.fmt. Return True or False.
+  """
+  n = os.path.basename(path)
+  try:
+    workdir = tempfile.mkdtemp(prefix = 'dump_', dir = os.path.dirname(path))
+  except OSError:
+    return False
+  try:
+    f = open(os.path.join(workdir, n + '.tex'), 'w')
+    f.write(header + cfg.dump)
+    f.close()
+    p = Popen(cfg.dumpcmd.format(latex, n, n + '.tex'), shell = True,
+      stdin = PIPE, stdout = PIPE, stderr = PIPE, cwd = workdir)
+    p.communicate()
+    fmt = os.path.join(workdir, n + '.fmt')
+    if p.returncode != 0 or not os.path.exists(fmt): return False
+    os.rename(fmt, path + '.fmt')
+    return True
+  except (IOError, OSError):
+    return False
+  finally:
+    shutil.rmtree(workdir, ignore_errors = True)
+
+
+def rejected(path, log, cfg = fs()):
+  """
+  Check the output log of a failed latex run with the format path: if
+  latex rejected the format, remove path.fmt (it is not built again by
+  this process) and return True, the caller then runs latex without it.
+  """
+  if not re.search(cfg.rejected_re, log or ""): return False
+  _failed.add(os.path.basename(path))
+  try:
+    os.remove(path + '.fmt')
+  except OSError:
+    pass
+  return True
+
+
+def clear(cfg = fs()):
+  """
+  Remove all formats (e.g. after a TeX update).
+  """
+  _failed.clear()
+  if not os.path.isdir(cfg.fmtdir): return
+  for f in os.listdir(cfg.fmtdir):
+    if f.endswith('.fmt'):
+      try:
+        os.remove(os.path.join(cfg.fmtdir, f))
+      except OSError:
+        pass
+
+
+
+
+def main():
+  pass
+
+if __name__ == '__main__':
+  main()
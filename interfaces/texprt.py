@@ -17,10 +17,19 @@ __loc_id__ = "hg.scios.ch/py_site_scios_tex"
 #;;;;;;;;;;;;
 import os, os.path
 import re
+import time
+import shutil
+import shlex
+import multiprocessing
+import threading
+import texcache
+import texfmt
+import texstats
 
 from subprocess import Popen, PIPE
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
 from copy import copy
+from collections import OrderedDict
 
 
 #;;;;;;;;;;;;;;;;;;;;;
@@ -34,6 +43,10 @@ fs._params = []
 
 fs.latex = 'latex'
 fs.dvipng = 'dvipng'
+fs.dvisvgm = 'dvisvgm'
+
+# Image format: 'png' (dvipng) or 'svg' (dvisvgm, resolution independent).
+fs.backend = 'png'
 
 fs.fontsize = 12
 fs.resolution = 150
@@ -54,29 +67,166 @@ fs.preamble = r'''\documentclass[%ipt]{article}
 %s
 \end{document}'''
 
-fs.latexcmd = r"{0} -halt-on-error"
+fs.latexcmd = r"{0} -halt-on-error -jobname={1}"
+fs.latexfmtcmd = r"{0} -halt-on-error -jobname={1} -fmt={2}"
 fs.dvipngcmd = r"{0} -T {1} -D {2:d} -bg {3} -fg {4} -O {5} -o {6} {7}"
 
+# dvisvgm: glyphs as paths defined once and referenced (-n), exact
+# bounding box (-e), relative path commands (-R) with 3 digits (-d 3),
+# optimized (-O); {1} pages, {2} output file (%p: page number).
+fs.dvisvgmcmd = r"{0} -n -e -R -d 3 -O -p {1} -o {2} {3}"
+
+# Use a precompiled format (texfmt) for the preamble.
+fs.use_fmt = True
+
+# Each render runs in its own working directory (created in workdir, None:
+# system temp dir) and uses the directory name as jobname, so that renders
+# may run concurrently. (jobname, dvifile, pngfile: no longer used.)
 fs.jobname = 'texput'
 fs.dvifile = fs.jobname + '.dvi'
 fs.pngfile = fs.jobname + '.png'
+fs.workdir = None
+fs.workdir_prefix = 'texprt_'
 
 fs.exts = ['dvi','aux','png','log'] # removed
 
+# Batch rendering (render_batch): one page per fragment. The empty box
+# keeps pages of fragments without output, so that page n is fragment n.
+fs.batch_page = "\\null\n%s\n\\clearpage\n"
+fs.batch_pngfile = '{0}%d.png'
+fs.batch_svgfile = '{0}%p.svg'
+
+# Cache of rendered images (texcache.PNGCache) or None (always render).
+fs.cache = texcache.cache
+
+# Concurrent renders of the same image run once (texcache.SingleFlight)
+# or None.
+fs.flights = texcache.flights
+
+# Resident latex processes (TeXWorker) or None. Renders the worker cannot
+# do (other preamble, errors) take the one-shot path. The worker belongs
+# to the process, don't set it in a cfg passed to RenderPool.
+fs.worker = None
+
 fs.errdvipng = 'Error (dvipng): use the log property for more information.'
 fs.errlatex = 'Error (latex): use the log property for more information.'
 
 #;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
 # Cache + manipulation functions ;;;
 #;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
-ObjCache = {}
-def putObj(x, y): ObjCache[id(x)] = y
-def getObj(x): return ObjCache[id(x)]
-def hasObj(x): return ObjCache.has_key(id(x))
+# Object -> TeX instance, bounded LRU. The object itself is kept with the
+# entry, so that its id cannot be reused while the entry exists. The images
+# are cached by content (texcache) anyway, ObjCache only saves the lookup.
+fs.objcache_size = 256
+
+ObjCache = OrderedDict()
+ObjLock = threading.Lock()
+
+def putObj(x, y):
+  ObjLock.acquire()
+  try:
+    ObjCache.pop(id(x), None)
+    ObjCache[id(x)] = (x, y)
+    while len(ObjCache) > fs.objcache_size:
+      ObjCache.popitem(last = False)
+  finally:
+    ObjLock.release()
+
+def getObj(x):
+  ObjLock.acquire()
+  try:
+    obj, y = ObjCache.pop(id(x))
+    ObjCache[id(x)] = (obj, y)
+    return y
+  finally:
+    ObjLock.release()
+
+def hasObj(x): return id(x) in ObjCache
 def getPNG(x): return getObj(x).png
 def clearCache(): ObjCache.clear()
 
 
+def latex_job(doc, jobname, cfg = fs()):
+  """
+  The latex command line, its input for the document doc and the format
+  used: the precompiled format of the preamble (texfmt) if cfg.use_fmt and
+  the format can be built, else None.
+  """
+  if cfg.use_fmt:
+    header, body = texfmt.split(doc)
+    if header is not None:
+      fmt = texfmt.get(header, cfg.latex)
+      if fmt is not None:
+        return cfg.latexfmtcmd.format(cfg.latex, jobname, fmt), body, fmt
+  return cfg.latexcmd.format(cfg.latex, jobname), doc, None
+
+
+def run_latex(doc, jobname, workdir, cfg = fs()):
+  """
+  Run latex on the document doc in workdir (see latex_job). If latex
+  rejects the format (e.g. after a TeX update) it is discarded and latex
+  runs once more without it.
+  Return: the command, its return code and output (stdout, stderr).
+  """
+  cmd, data, fmt = latex_job(doc, jobname, cfg)
+  p = Popen(cmd, shell = True, stdin = PIPE, stdout = PIPE, cwd = workdir)
+  log = p.communicate(data)
+  if p.returncode != 0 and fmt is not None and texfmt.rejected(fmt, log[0]):
+    cmd = cfg.latexcmd.format(cfg.latex, jobname)
+    p = Popen(cmd, shell = True, stdin = PIPE, stdout = PIPE, cwd = workdir)
+    log = p.communicate(doc)
+  return cmd, p.returncode, log
+
+
+def cache_key(src, cfg = fs()):
+  """
+  The texcache key of src: the source and every setting the image
+  depends on.
+  """
+  if cfg.backend == 'svg':
+    return texcache.key('texprt', cfg.preamble, cfg.fontsize, src,
+      cfg.latex, cfg.backend, cfg.dvisvgm, cfg.dvisvgmcmd, cfg.forecolor)
+  return texcache.key('texprt', cfg.preamble, cfg.fontsize, src,
+    cfg.latex, cfg.dvipng, cfg.imagesize, cfg.resolution, cfg.backcolor,
+    cfg.forecolor, cfg.offset)
+
+
+def dvicmd(jobname, cfg = fs(), pages = False):
+  """
+  The command converting jobname.dvi to an image (cfg.backend) and the
+  name of the image file; with pages = True one image per page, the file
+  name then contains %d for the page number.
+  """
+  dvifile = jobname + '.dvi'
+  if cfg.backend == 'svg':
+    if pages:
+      imgfile = cfg.batch_svgfile.format(jobname)
+    else:
+      imgfile = jobname + '.svg'
+    cmd = cfg.dvisvgmcmd.format(cfg.dvisvgm, pages and '1-' or '1', imgfile,
+      dvifile)
+    return cmd, imgfile.replace('%p', '%d')
+  if pages:
+    imgfile = cfg.batch_pngfile.format(jobname)
+  else:
+    imgfile = jobname + '.png'
+  cmd = cfg.dvipngcmd.format(cfg.dvipng, cfg.imagesize, cfg.resolution,
+    cfg.backcolor, cfg.forecolor, cfg.offset, imgfile, dvifile)
+  return cmd, imgfile
+
+
+def read_image(filename, cfg = fs()):
+  """
+  Read the image written by the dvicmd command; an SVG image gets the
+  foreground color cfg.forecolor (see texcache.colorize).
+  """
+  f = open(filename, 'rb')
+  img = f.read()
+  f.close()
+  if cfg.backend == 'svg': img = texcache.colorize(img, cfg.forecolor)
+  return img
+
+
 #;;;;;;;;;;;;;;
 # Class TeX ;;;
 #;;;;;;;;;;;;;;
@@ -108,6 +258,15 @@ class TeX():
     # The PNG image (string/x89PNG)
     self.png = None
 
+    # The SVG image (backend 'svg')
+    self.svg = None
+
+    # Timing record of the last render (texstats.Timing)
+    self.timing = None
+
+    # Private working directory of the current render
+    self.workdir = None
+
     # Render now or later?
     if cfg.initrender:
       self.render(self.cfg)
@@ -116,66 +275,129 @@ class TeX():
   def render(self, cfg):
     """
     Run latex then convert the dvi output to png. The mandatory cfg
-    has to be an instance of fs (usually self.cfg).
+    has to be an instance of fs (usually self.cfg). All files are written
+    to a private working directory, which is removed afterwards. If the
+    image is in cfg.cache, nothing is run at all; if the same image is
+    being rendered by another thread, its result is used.
     """
-    # Default template
-    self.preamble = cfg.preamble % (cfg.fontsize, self.src)
-
-    # LaTeX command
-    self.latex = cfg.latexcmd.format(cfg.latex)
-
-    # Dvipng command
-    self.dvipng = cfg.dvipngcmd.format(cfg.dvipng, cfg.imagesize,
-      cfg.resolution, cfg.backcolor, cfg.forecolor, cfg.offset,
-      cfg.pngfile, cfg.dvifile)
-
-    # Note: going to write to latex's stdin => needs to be piped
-    p = Popen(self.latex, shell = True, stdin = PIPE, stdout = PIPE)
-
-    # Send input & read stdout/stderr
-    log = p.communicate(cfg.preamble % (cfg.fontsize, self.src))
-
-    # Check for errors (<>0)
-    if  p.returncode != 0:
-      print cfg.errlatex
-      self.log = log
-      self.cleanup()
+    self.timing = texstats.Timing()
+
+    # Same source and settings => same image
+    key = self.cache_key(cfg)
+    if cfg.cache is not None:
+      img = cfg.cache.get(key, cfg.backend)
+      if img is not None:
+        self._set_image(img, cfg)
+        self.timing.done(img, 'hit')
+        return
+
+    if cfg.flights is None:
+      self.timing.done(self._render(cfg, key))
       return
 
-    # Run the dvi to png conversion
-    p = Popen(self.dvipng, shell = True, stdout = PIPE)
+    ran = []
+    def run():
+      ran.append(True)
+      return self._render(cfg, key)
+    img = cfg.flights.do(key, run)
+    self._set_image(img, cfg)
+    if ran:
+      self.timing.done(img)
+    else:
+      self.timing.queue = time.time() - self.timing.start
+      self.timing.done(img, 'shared')
 
-    # Read stdout/stderr
-    log = p.communicate()
 
-    # Check for errors (<>0)
-    if p.returncode != 0:
-      print cfg.errdvipng
-      self.log = log
-      self.cleanup()
-      return
+  def _set_image(self, img, cfg):
+    """
+    Store img in self.png or self.svg (cfg.backend).
+    """
+    if cfg.backend == 'svg':
+      self.svg = img
+    else:
+      self.png = img
 
-    # Set the png image path
-    self.pngfile = cfg.pngfile
 
-    # Read and store the PNG image (use binary read)
-    f = open(self.pngfile, 'rb')
-    self.png = f.read()
-    f.close()
+  def _render(self, cfg, key):
+    """
+    Render (see render) and store the image in cfg.cache. Return the
+    image or None.
+    """
+    # Resident latex process
+    if cfg.worker is not None:
+      img = cfg.worker.render(self.src, cfg, self.timing)
+      if img is not None:
+        self._set_image(img, cfg)
+        if cfg.cache is not None: cfg.cache.put(key, img, cfg.backend)
+        return img
+
+    # Private working directory and unique jobname
+    workdir = mkdtemp(prefix = cfg.workdir_prefix, dir = cfg.workdir)
+    self.workdir = workdir
+    jobname = os.path.basename(workdir)
 
-    # Remove all output files
-    self.cleanup()
+    try:
+      # Default template
+      self.preamble = cfg.preamble % (cfg.fontsize, self.src)
+
+      # Dvipng (or dvisvgm) command
+      self.dvipng, imgfile = dvicmd(jobname, cfg)
+
+      # Run latex (input via stdin), with the precompiled preamble
+      t = texstats.Timer()
+      self.latex, rc, log = run_latex(self.preamble, jobname, workdir, cfg)
+      self.timing.latex, self.timing.latex_cpu = t.stop()
+
+      # Check for errors (<>0)
+      if rc != 0:
+        print cfg.errlatex
+        self.log = log
+        return None
+
+      # Run the dvi to png conversion
+      t = texstats.Timer()
+      p = Popen(self.dvipng, shell = True, stdout = PIPE, cwd = workdir)
+
+      # Read stdout/stderr
+      log = p.communicate()
+      self.timing.dvipng, self.timing.dvipng_cpu = t.stop()
+
+      # Check for errors (<>0)
+      if p.returncode != 0:
+        print cfg.errdvipng
+        self.log = log
+        return None
+
+      # Set the image path
+      self.pngfile = os.path.join(workdir, imgfile)
+
+      # Read and store the image (use binary read)
+      img = read_image(self.pngfile, cfg)
+      self._set_image(img, cfg)
+      if cfg.cache is not None: cfg.cache.put(key, img, cfg.backend)
+      return img
+
+    # Remove all output files (also on errors and exceptions)
+    finally:
+      shutil.rmtree(workdir, True)
+      self.workdir = None
+      self.pngfile = None
+
+
+  def cache_key(self, cfg):
+    """
+    The texcache key: source and every setting the image depends on.
+    """
+    return cache_key(self.src, cfg)
 
 
   def cleanup(self):
     """
-    Remove all fs.jobname{fs.exts} files and reset pngfile to None.
+    Remove the working directory (with all files) and reset pngfile to None.
     """
-    try:
-      for f in map(lambda x: self.cfg.jobname + '.' + x, self.cfg.exts):
-        os.remove(f)
-    except:
-      pass
+    if self.workdir is not None:
+      shutil.rmtree(self.workdir, ignore_errors = True)
+      self.workdir = None
     self.pngfile = None
 
 
@@ -260,6 +482,374 @@ class TeX():
     return self.png
 
 
+  def _repr_svg_(self):
+    """
+    Representation as svg image (backend 'svg').
+    """
+    return self.svg
+
+
+
+
+#;;;;;;;;;;;;;;;;;;;;;
+# Class TeXWorker ;;;
+#;;;;;;;;;;;;;;;;;;;;;
+class TeXWorker():
+  """
+  Resident latex processes: spares are started in advance (no shell, the
+  precompiled format of the preamble loaded) and wait for the document
+  body on stdin, so that a render only pays for typesetting and dvipng.
+  Each spare renders one fragment (latex writes the complete dvi file only
+  at the end of its input), a new spare is started right away.
+  Example:
+    w = TeXWorker()
+    cfg = fs(); cfg.worker = w
+    t = TeX(r"$x^2$", cfg)
+    w.close()
+  """
+
+  def __init__(self, spares = 1, cfg = fs()):
+    """
+    Start spares latex processes for the preamble of cfg.
+    """
+    self.cfg = copy(cfg)
+    self.nspares = spares
+    self.header = texfmt.split(cfg.preamble % (cfg.fontsize, ''))[0]
+    self.spares = []
+    self.lock = threading.Lock()
+    self.renders = 0
+    self.errors = 0
+    self.closed = False
+    for i in range(spares): self._refill()
+
+
+  def _spawn(self):
+    """
+    Start a latex process in a private working directory. Return
+    (process, workdir, jobname) or None.
+    """
+    fmt = texfmt.get(self.header, self.cfg.latex)
+    if fmt is None: return None
+    workdir = mkdtemp(prefix = self.cfg.workdir_prefix, dir = self.cfg.workdir)
+    jobname = os.path.basename(workdir)
+    cmd = self.cfg.latexfmtcmd.format(self.cfg.latex, jobname, fmt)
+    try:
+      p = Popen(shlex.split(cmd), stdin = PIPE, stdout = PIPE, stderr = PIPE,
+        cwd = workdir)
+    except OSError:
+      shutil.rmtree(workdir, ignore_errors = True)
+      return None
+    return p, workdir, jobname
+
+
+  def _refill(self):
+    """
+    Start a new spare unless there are enough.
+    """
+    self.lock.acquire()
+    try:
+      if self.closed or len(self.spares) >= self.nspares: return
+    finally:
+      self.lock.release()
+    spare = self._spawn()
+    if spare is None: return
+    self.lock.acquire()
+    try:
+      if not self.closed:
+        self.spares.append(spare)
+        return
+    finally:
+      self.lock.release()
+    self._discard(spare)
+
+
+  def _take(self):
+    """
+    A live spare (or a new process if there is none) or None.
+    """
+    while True:
+      self.lock.acquire()
+      try:
+        spare = self.spares and self.spares.pop(0) or None
+      finally:
+        self.lock.release()
+      if spare is None: return self._spawn()
+      if spare[0].poll() is None: return spare
+      self._discard(spare)
+
+
+  def _discard(self, spare):
+    p, workdir, jobname = spare
+    if p.poll() is None:
+      p.kill()
+      p.wait()
+    shutil.rmtree(workdir, ignore_errors = True)
+
+
+  def render(self, src, cfg = None, timing = None):
+    """
+    Render src with a spare latex process and dvipng (dvisvgm); the
+    image settings are taken from cfg (default: self.cfg). Return the
+    image or None (other preamble than the worker's, errors). The times
+    are stored in timing (texstats.Timing), if given.
+    """
+    if cfg is None: cfg = self.cfg
+    if timing is None: timing = texstats.Timing()
+    doc = cfg.preamble % (cfg.fontsize, src)
+    header, body = texfmt.split(doc)
+    if header != self.header or cfg.latex != self.cfg.latex: return None
+    t = time.time()
+    spare = self._take()
+    timing.queue += time.time() - t
+    self._refill()
+    if spare is None: return None
+    p, workdir, jobname = spare
+    try:
+      t = texstats.Timer()
+      p.communicate(body)
+      timing.latex, timing.latex_cpu = t.stop()
+      if p.returncode != 0:
+        self.errors += 1
+        return None
+      cmd, imgfile = dvicmd(jobname, cfg)
+      t = texstats.Timer()
+      q = Popen(shlex.split(cmd), stdout = PIPE, stderr = PIPE, cwd = workdir)
+      q.communicate()
+      timing.dvipng, timing.dvipng_cpu = t.stop()
+      if q.returncode != 0:
+        self.errors += 1
+        return None
+      img = read_image(os.path.join(workdir, imgfile), cfg)
+      self.renders += 1
+      return img
+    except (IOError, OSError):
+      self.errors += 1
+      return None
+    finally:
+      self._discard(spare)
+
+
+  def close(self):
+    """
+    Stop the spare processes.
+    """
+    self.lock.acquire()
+    try:
+      self.closed = True
+      spares, self.spares = self.spares, []
+    finally:
+      self.lock.release()
+    for spare in spares: self._discard(spare)
+
+
+  def stats(self):
+    """
+    Return the number of spares, renders and errors (fallbacks).
+    """
+    return {'spares':len(self.spares), 'renders':self.renders,
+      'errors':self.errors}
+
+
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+# Parallel rendering service ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+def render_png(src, cfg = fs()):
+  """
+  Render the TeX code src and return the PNG image (the SVG image with
+  cfg.backend = 'svg'), None on errors.
+  """
+  cfg = copy(cfg)
+  cfg.initrender = False
+  t = TeX(src, cfg)
+  t.render(t.cfg)
+  if cfg.backend == 'svg': return t.svg
+  return t.png
+
+
+def _render_png(args):
+  """
+  RenderPool worker: render, return the image and the timing record
+  (the parent adds it to its texstats.stats).
+  """
+  src, cfg, submitted = args
+  queue = time.time() - submitted
+  cfg = copy(cfg)
+  cfg.initrender = False
+  t = TeX(src, cfg)
+  t.render(t.cfg)
+  t.timing.queue += queue
+  if cfg.backend == 'svg': return t.svg, t.timing.as_dict()
+  return t.png, t.timing.as_dict()
+
+
+def _recorded(result):
+  img, timing = result
+  if texstats.fs.enabled: texstats.stats.record(texstats.Timing(timing))
+  return img
+
+
+def _render_batch(args):
+  """
+  RenderPool worker: render_batch, return the images and the timing
+  records (see texstats.Stats.collect).
+  """
+  return texstats.stats.collect(render_batch, *args)
+
+
+def _render_async(src, cfg):
+  """
+  RenderPool worker: render_png, return the image and the timing records.
+  """
+  return texstats.stats.collect(render_png, src, cfg)
+
+
+def _render_pages(srcs, cfg, timing):
+  """
+  Render the fragments srcs as the pages of one document (one latex and
+  one dvipng/dvisvgm run). Return the list of images or None on errors.
+  The times are stored in timing.
+  """
+  workdir = mkdtemp(prefix = cfg.workdir_prefix, dir = cfg.workdir)
+  try:
+    jobname = os.path.basename(workdir)
+    body = "".join([cfg.batch_page % src for src in srcs])
+    doc = cfg.preamble % (cfg.fontsize, body)
+
+    t = texstats.Timer()
+    cmd, rc, log = run_latex(doc, jobname, workdir, cfg)
+    timing.latex, timing.latex_cpu = t.stop()
+    if rc != 0: return None
+
+    cmd, imgfile = dvicmd(jobname, cfg, pages = True)
+    t = texstats.Timer()
+    p = Popen(cmd, shell = True, stdout = PIPE, cwd = workdir)
+    p.communicate()
+    timing.dvipng, timing.dvipng_cpu = t.stop()
+    if p.returncode != 0: return None
+
+    imgs = []
+    for n in range(1, len(srcs) + 1):
+      try:
+        imgs.append(read_image(os.path.join(workdir, imgfile % n), cfg))
+      except IOError:
+        return None # page count does not match
+    return imgs
+  finally:
+    shutil.rmtree(workdir, ignore_errors = True)
+
+
+def render_batch(srcs, cfg = fs()):
+  """
+  Render the list of TeX fragments srcs with a single latex and dvipng
+  (dvisvgm) run, one page per fragment, and return the images in the same
+  order (None for failed renders). Cached and repeated fragments are rendered
+  only once; if the batch fails (e.g. a fragment has errors) the fragments
+  are rendered one by one.
+  """
+  keys = [cache_key(src, cfg) for src in srcs]
+  found = {}
+  todo = OrderedDict()
+  for k, src in zip(keys, srcs):
+    if k in found or k in todo: continue
+    png = None
+    if cfg.cache is not None: png = cfg.cache.get(k, cfg.backend)
+    if png is None:
+      todo[k] = src
+    else:
+      found[k] = png
+      texstats.Timing().done(png, 'hit')
+  if todo:
+    timing = texstats.Timing()
+    timing.n = len(todo)
+    pngs = _render_pages(todo.values(), cfg, timing)
+    if pngs is None:
+      pngs = [render_png(src, cfg) for src in todo.values()]
+    else:
+      timing.done("".join(pngs))
+    for k, png in zip(todo.keys(), pngs):
+      found[k] = png
+      if cfg.cache is not None: cfg.cache.put(k, png, cfg.backend)
+  return [found[k] for k in keys]
+
+
+class RenderPool():
+  """
+  Render many TeX fragments in parallel with a pool of worker processes.
+  Example:
+    rp = RenderPool()
+    pngs = rp.render([r"$x^2$", r"$\sqrt{2}$"])
+    rp.close()
+  """
+
+  def __init__(self, processes = None):
+    """
+    Start the workers (default: one per CPU).
+    """
+    self.processes = processes or multiprocessing.cpu_count()
+    self.pool = multiprocessing.Pool(self.processes)
+
+
+  def render(self, srcs, cfg = fs()):
+    """
+    Render all fragments of the list srcs; return the list of PNG images
+    in the same order (None for failed renders).
+    """
+    now = time.time()
+    results = self.pool.map(_render_png, [(src, cfg, now) for src in srcs])
+    return [_recorded(r) for r in results]
+
+
+  def render_batch(self, srcs, cfg = fs()):
+    """
+    Like render, but each worker renders a chunk of srcs with render_batch
+    (one latex and dvipng run per worker).
+    """
+    size = max(1, -(-len(srcs) // self.processes))
+    chunks = [srcs[i:i + size] for i in range(0, len(srcs), size)]
+    pngs = []
+    for chunk, records in self.pool.map(_render_batch,
+      [(c, cfg) for c in chunks]):
+      texstats.stats.merge(records)
+      pngs.extend(chunk)
+    return pngs
+
+
+  def render_async(self, src, cfg = fs(), callback = None):
+    """
+    Render src in the background; return a multiprocessing AsyncResult
+    (get() yields the PNG image), callback(png) is called when done.
+    """
+    def done(result):
+      img, records = result
+      texstats.stats.merge(records)
+      if callback is not None: callback(img)
+    return _AsyncImage(self.pool.apply_async(_render_async, (src, cfg),
+      callback = done))
+
+
+  def close(self):
+    """
+    Stop the workers.
+    """
+    self.pool.close()
+    self.pool.join()
+
+
+class _AsyncImage():
+  """
+  The AsyncResult of RenderPool.render_async: get() yields the image
+  without the timing records.
+  """
+  def __init__(self, result):
+    self.result = result
+
+  def get(self, timeout = None):
+    return self.result.get(timeout)[0]
+
+  def __getattr__(self, name):
+    return getattr(self.result, name)
 
 
 
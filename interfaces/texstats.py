@@ -0,0 +1,260 @@
+# -*- coding: UTF-8 -*-
+#!/usr/bin/env python
+
+__author__ = "Kurt Pagani <pagani@scios.ch>"
+__svn_id__ = "$Id:$"
+
+
+"""
+Module texstats:
+  - Timing: the record of one render (texprt.TeX.timing, app_latex.TeX.timing)
+    with the queue wait, latex and dvipng wall/CPU time, the image bytes
+    and how the image was obtained (cache hit, rendered, shared with a
+    concurrent render, error).
+  - Stats: histograms of all records (module instance stats), queried by
+    stats.snapshot() and exported by wax.py (/stats).
+
+  The CPU times are those of the child processes (os.times), measured
+  around each run; with concurrent renders they include the CPU time of
+  other children finished in the meantime.
+"""
+
+
+import os
+import time
+import threading
+
+
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+# Defaults (factory settings) ;;;
+#;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+class fs: pass
+fs.__doc__ = """texstats factory settings"""
+
+# Upper bounds of the histogram buckets: times in ms, sizes in bytes (the
+# last bucket takes the rest).
+fs.ms_bounds = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+fs.byte_bounds = [256, 1024, 4096, 16384, 65536, 262144, 1048576]
+
+# Record the timings into stats.
+fs.enabled = True
+
+
+def cputime():
+  """
+  User + system CPU time of the terminated child processes.
+  """
+  t = os.times()
+  return t[2] + t[3]
+
+
+class Timer():
+  """
+  Wall and (children) CPU time since creation.
+  """
+  def __init__(self):
+    self.wall = time.time()
+    self.cpu = cputime()
+
+  def stop(self):
+    """
+    Return: wall and CPU seconds.
+    """
+    return time.time() - self.wall, cputime() - self.cpu
+
+
+#;;;;;;;;;;;;;;;;;;
+# Class Timing ;;;
+#;;;;;;;;;;;;;;;;;;
+class Timing():
+  """
+  Timing record of a render (seconds, bytes). cache is one of 'hit',
+  'miss' (rendered), 'shared' (waited for a concurrent render), 'error'.
+  """
+  fields = ['queue', 'latex', 'latex_cpu', 'dvipng', 'dvipng_cpu', 'total']
+
+  def __init__(self, d = None):
+    """
+    A new record, or a copy of the record d (as_dict, e.g. from another
+    process).
+    """
+    self.start = time.time()
+    self.queue = 0.0
+    self.latex = 0.0
+    self.latex_cpu = 0.0
+    self.dvipng = 0.0
+    self.dvipng_cpu = 0.0
+    self.total = 0.0
+    self.bytes = 0
+    self.n = 1  # fragments (batch)
+    self.cache = 'miss'
+    if d is not None: self.__dict__.update(d)
+
+
+  def done(self, img, cache = None):
+    """
+    Set total, bytes (and cache) then add the record to stats.
+    """
+    self.total = time.time() - self.start
+    if img is None:
+      self.cache = 'error'
+    else:
+      self.bytes = len(img)
+      if cache is not None: self.cache = cache
+    if fs.enabled: stats.record(self)
+    return self
+
+
+  def as_dict(self):
+    d = dict([(f, getattr(self, f)) for f in self.fields])
+    d.update({'bytes':self.bytes, 'n':self.n, 'cache':self.cache})
+    return d
+
+
+  def __repr__(self):
+    return "<Timing %s total %.1f ms (latex %.1f, dvipng %.1f), %i bytes>" % (
+      self.cache, self.total * 1e3, self.latex * 1e3, self.dvipng * 1e3,
+      self.bytes)
+
+
+#;;;;;;;;;;;;;;;;;;;;;
+# Class Histogram ;;;
+#;;;;;;;;;;;;;;;;;;;;;
+class Histogram():
+  """
+  Counts per bucket (value <= bound), count, sum and max.
+  """
+  def __init__(self, bounds):
+    self.bounds = bounds
+    self.reset()
+
+
+  def reset(self):
+    self.counts = [0] * (len(self.bounds) + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+
+  def add(self, v):
+    i = 0
+    while i < len(self.bounds) and v > self.bounds[i]: i += 1
+    self.counts[i] += 1
+    self.count += 1
+    self.sum += v
+    if v > self.max: self.max = v
+
+
+  def percentile(self, p):
+    """
+    The bucket bound below which p percent of the values are (max for the
+    last bucket), None if empty.
+    """
+    if self.count == 0: return None
+    k = self.count * p / 100.0
+    n = 0
+    for i, c in enumerate(self.counts):
+      n += c
+      if n >= k and c:
+        if i < len(self.bounds): return self.bounds[i]
+        break
+    return self.max
+
+
+  def as_dict(self):
+    return {'bounds':self.bounds, 'counts':self.counts, 'count':self.count,
+      'sum':self.sum, 'max':self.max,
+      'mean':self.count and self.sum / self.count or 0.0,
+      'p50':self.percentile(50), 'p90':self.percentile(90),
+      'p99':self.percentile(99)}
+
+
+#;;;;;;;;;;;;;;;;;
+# Class Stats ;;;
+#;;;;;;;;;;;;;;;;;
+class Stats():
+  """
+  Aggregate of the Timing records: one histogram (ms) per time field, one
+  for the bytes, counters per cache outcome.
+  """
+  def __init__(self, cfg = fs()):
+    self.cfg = cfg
+    self.lock = threading.Lock()
+    self.pending = None # records kept for collect
+    self.reset()
+
+
+  def reset(self):
+    self.times = dict([(f, Histogram(self.cfg.ms_bounds))
+      for f in Timing.fields])
+    self.bytes = Histogram(self.cfg.byte_bounds)
+    self.cache = {'hit':0, 'miss':0, 'shared':0, 'error':0}
+    self.fragments = 0
+
+
+  def record(self, t):
+    """
+    Add the Timing t.
+    """
+    self.lock.acquire()
+    try:
+      if t.cache == 'miss':
+        for f in Timing.fields: self.times[f].add(getattr(t, f) * 1e3)
+      else:
+        self.times['queue'].add(t.queue * 1e3)
+        self.times['total'].add(t.total * 1e3)
+      if t.bytes: self.bytes.add(t.bytes)
+      self.cache[t.cache] = self.cache.get(t.cache, 0) + 1
+      self.fragments += t.n
+      if self.pending is not None: self.pending.append(t.as_dict())
+    finally:
+      self.lock.release()
+
+
+  def collect(self, fn, *args):
+    """
+    Call fn(*args) (e.g. in a worker process, one call at a time).
+    Return: its result and the records (as_dict) added meanwhile, which
+    the parent process adds to its stats by merge.
+    """
+    self.pending = []
+    try:
+      return fn(*args), self.pending
+    finally:
+      self.pending = None
+
+
+  def merge(self, records):
+    """
+    Add the records (as_dict) from another process, see collect.
+    """
+    if not self.cfg.enabled: return
+    for d in records: self.record(Timing(d))
+
+
+  def snapshot(self):
+    """
+    Return the histograms and counters as a dict (json-able).
+    """
+    self.lock.acquire()
+    try:
+      d = dict([(f + '_ms', h.as_dict()) for f, h in self.times.items()])
+      d['bytes'] = self.bytes.as_dict()
+      d['cache'] = dict(self.cache)
+      d['fragments'] = self.fragments
+      return d
+    finally:
+      self.lock.release()
+
+
+# The statistics of all renders in this process.
+stats = Stats()
+
+
+
+
+def main():
+  pass
+
+if __name__ == '__main__':
+  main()
@@ -11,6 +11,8 @@ import re
 import string
 
 from scios.axiom.axiom import Axiom0
+import texprt
+import axparse
 
 DATA_BEGIN = chr(2)
 DATA_END = chr(5)
@@ -74,29 +76,21 @@ def get_type_and_value(output):
   """
   Get index, type and value in the 'output'.
   """
-  r = output.strip(" \n").split("Type:")
-  ri = re.match("^\(([0-9]+)\)", r[0]).group(1)
-  rv = re.split("^\([0-9]+\)",r[0])[1].strip(" \n")
-  rv = re.sub("_\n","", rv)
-  rt = r[1].strip()
-  return ri, rt, rv
+  return axparse.type_and_value(output)
 
 
 def extract_types(data):
   """
   Extract the type(s) returned (if any).
   """
-  ty = re.findall('Type:[a-zA-Z0-9_. ]*', data)
-  ty = map(lambda x: x.replace('Type:',''), ty)
-  return map(lambda x: x.strip(), ty)
+  return axparse.plain.parse(data).types
 
 
 def extract_tex(data):
   """
   Extract TeX code from data.
   """
-  tex = re.findall('\$\$[^\$]*\$\$', data)
-  return tex
+  return axparse.plain.parse(data).tex
 
 
 def remove_tex(data, tex = []):
@@ -134,17 +128,17 @@ def modPrompt(prompt):
   return p
 
 
-def processOutput(data):
+def processOutput(data, images = False):
   """
-  Process the raw output.
+  Process the raw output. Return the text and the list of TeX fragments,
+  and if images = True also their PNG images (texprt.render_batch: all
+  fragments in a single latex and dvipng run).
   """
-  tex = extract_tex(data)
-  txt = remove_tex(data,tex)
-  tex = map(lambda t: re.sub(r"\\leqno\(\d*\)", "", t), tex)
-  tex = map(lambda t: re.sub(r"\\sp\s*([^ \t\r\n\f\v\\]*)", r"^{\1}", t), tex)
-  tex = map(lambda t: re.sub(r"\\sb\s*([^ \t\r\n\f\v\\]*)", r"_{\1}", t), tex)
-  tex = map(lambda t: re.sub(r"\\root\s*(\{\d*\})\s*\\of", r"\\sqrt[\1]", t), tex)
-  tex = map(lambda t: PRETEX+t, tex)
+  p = axparse.tm.parse(data) # single pass, see axparse
+  txt = p.txt()
+  tex = [PRETEX + t for t in p.tex]
+  if images:
+    return txt, tex, texprt.render_batch(tex)
   return txt, tex
 
 
@@ -79,7 +79,8 @@ function addEditor(n) {
               matchBrackets: false,
               autofocus: true,
               extraKeys: {"Ctrl-Space": "autocomplete",
-                          "Ctrl-Enter": "dispatch"} });
+                          "Ctrl-Enter": "dispatch",
+                          "Esc": "cancel"} });
   return ed;
 }
 
@@ -91,6 +92,57 @@ CodeMirror.commands.autocomplete = function(cm) {
 
 
 
+// set the text of the output cell n
+function setOutput(n, data) {
+  var outcode = document.getElementById("id.code:"+n)
+  var txt = document.createTextNode(data)
+
+  if (outcode.hasChildNodes() == false )
+    {outcode.appendChild(txt)}
+  else
+    {outcode.replaceChild(txt, outcode.firstChild)}; //img node?
+  return outcode;
+}
+
+
+// send the input to /stream and show the output of cell n while it arrives
+function streamOutput(n, value) {
+  var xhr = new XMLHttpRequest();
+  var shown = 0;
+
+  xhr.open("POST", "/stream", true);
+  xhr.setRequestHeader("Content-Type", "text/plain; charset=UTF-8");
+  xhr.onreadystatechange = function() {
+    if (xhr.readyState == 3 && xhr.responseText.length > shown) {
+      shown = xhr.responseText.length;
+      setOutput(n, xhr.responseText);
+    }
+    if (xhr.readyState == 4) {
+      var outcode = setOutput(n, xhr.responseText);
+      MathJax.Hub.Queue(["Typeset",MathJax.Hub,outcode]);
+    }
+  };
+  xhr.send(value);
+}
+
+
+// interrupt the running computation (the output arrives via /stream)
+function cancelComputation() {
+  jQuery.ajax({
+    type: "POST",
+    url: "/cancel",
+    data: "",
+    dataType: "text"
+  });
+}
+
+
+// cancel command
+CodeMirror.commands.cancel = function(cm) {
+  cancelComputation();
+}
+
+
 // dispatch command
 CodeMirror.commands.dispatch = function(cm) {
 
@@ -98,21 +150,7 @@ CodeMirror.commands.dispatch = function(cm) {
   var id = textarea.getAttribute("id"); // get the id of the editor/area
   var value = cm.getValue(); // get editor contents
 
-  jQuery.ajax({
-    type: "POST",
-    data: value,
-    dataType: "text",
-    success: function(data) {
-      var outcode = document.getElementById("id.code:"+id)
-      var txt = document.createTextNode(getCodeData(data))
-
-      if (outcode.hasChildNodes() == false )
-        {outcode.appendChild(txt)}
-      else
-        {outcode.replaceChild(txt, outcode.firstChild)}; //img node?
-        MathJax.Hub.Queue(["Typeset",MathJax.Hub,outcode]);
-     },
-  });
+  streamOutput(id, value);
 
 
 
@@ -7,17 +7,60 @@ __svn_id__ = "$Id: wax.py 3 2008-01-22 19:51:27Z scios$"
 
 
 import web
+import uuid
+import json
+import base64
 
 from string import Template
-from interfaces.axiom import Axiom0
+from interfaces.pool import AxiomPool
+from interfaces import texprt, texcache, texstats, axparse
 
 out = Template("<code>$txt</code>")
 
-urls = ('/', 'index')
+urls = ('/', 'index',
+        '/stream', 'stream',
+        '/cancel', 'cancel',
+        '/tex', 'tex',
+        '/stats', 'stats',
+        '/render/([0-9a-f]{40})\.(png|svg)', 'image')
 render = web.template.render('templates/')
 
-ax = Axiom0()
-ax.start()
+# Warm Axiom processes, one per browser session (cookie wax_sid)
+pool = AxiomPool()
+pool.start()
+
+def session_id():
+  """
+  Return the session id of the browser (set the cookie if missing).
+  """
+  sid = web.cookies(wax_sid = None).wax_sid
+  if sid is None:
+    sid = uuid.uuid4().hex
+    web.setcookie('wax_sid', sid)
+  return sid
+
+mimetypes = {'png':'image/png', 'svg':'image/svg+xml'}
+
+# Cache-Control of /render/<key> (the content of a URL never changes)
+immutable = 'public, max-age=31536000, immutable'
+
+# Rendered images up to this size (bytes) are inlined as data URIs
+inline_max = 1024
+
+def image_src(src):
+  """
+  Render the TeX code src (texprt, cached) and return the src of its img
+  element: a data URI for small images, else /render/<key>.png (.svg if
+  texprt.fs.backend = 'svg'). Return None on errors.
+  """
+  cfg = texprt.fs()
+  img = texprt.render_png(src, cfg)
+  if img is None:
+    return None
+  if len(img) <= inline_max or cfg.cache is None:
+    return "data:%s;base64,%s" % (mimetypes[cfg.backend],
+      base64.b64encode(img))
+  return "/render/%s.%s" % (texprt.cache_key(src, cfg), cfg.backend)
 
 class index:
 
@@ -30,20 +73,123 @@ class index:
 
   def POST(self):
     data = web.data() # get input
+    sid = session_id()
     if data.startswith(")quit"):
-      ax.stop()
+      pool.release(sid)
       return out.substitute(txt="Axiom stopped.")
-    ax.write(data) # send input to Axiom
-    if ax.hasoutput():
-      return out.substitute(txt=ax.output) # return Axiom output
-    else:
-      return out.substitute(txt="NIL")
+    ax = pool.acquire(sid)
+    if ax is None:
+      return out.substitute(txt="Axiom not available.")
+    lock = pool.lock(sid)
+    lock.acquire()
+    try:
+      ax.write(data) # send input to Axiom
+      if ax.hasoutput():
+        # Axiom output, TeX (\sp, \sb, ...) rewritten for MathJax
+        return out.substitute(txt=axparse.tm.parse(ax.output).join())
+      else:
+        return out.substitute(txt="NIL")
+    finally:
+      lock.release()
+
+
+class stream:
+  """
+  Same as index.POST, but the output is sent (chunked, text/plain) while
+  Axiom produces it, TeX fragments rewritten for MathJax when complete.
+  """
+
+  def POST(self):
+    data = web.data()
+    sid = session_id()
+    web.header('Content-Type', 'text/plain; charset=UTF-8')
+    web.header('Cache-Control', 'no-cache')
+    if data.startswith(")quit"):
+      pool.release(sid)
+      return "Axiom stopped."
+    ax = pool.acquire(sid)
+    if ax is None:
+      return "Axiom not available."
+    return self.chunks(ax, pool.lock(sid), data)
+
+  def chunks(self, ax, lock, data):
+    lock.acquire()
+    try:
+      for chunk in axparse.tm.join_iter(ax.write_iter(data)):
+        yield chunk
+      if ax.haserror():
+        yield "\nNIL"
+    finally:
+      lock.release()
+
+
+class cancel:
+  """
+  Interrupt the computation running in the session's Axiom process.
+  """
+
+  def POST(self):
+    ax = pool.get(session_id())
+    if ax is not None and ax.interrupt():
+      return out.substitute(txt="Interrupted.")
+    return out.substitute(txt="Nothing to cancel.")
+
+
+class tex:
+  """
+  Render the posted TeX code, return an img element.
+  """
+
+  def POST(self):
+    src = image_src(web.data())
+    if src is None:
+      return out.substitute(txt="TeX error.")
+    return '<img src="%s"/>' % src
+
+
+class image:
+  """
+  Rendered images by texcache key and format. The key is a hash of the TeX
+  code and all render settings, so the content of a URL never changes.
+  """
+
+  def GET(self, key, ext):
+    # 304 if the browser has it, checked first: the image may have been
+    # evicted from the cache, the browser's copy is still valid
+    try:
+      web.modified(etag = key + '.' + ext)
+    except web.notmodified:
+      web.header('Cache-Control', immutable)
+      raise
+    img = texcache.cache.get(key, ext) # None if cached in another format
+    if img is None:
+      raise web.notfound() # not cached, so that a re-render is fetched
+    web.header('Cache-Control', immutable)
+    web.header('Content-Type', mimetypes[ext])
+    return img
+
+
+class stats:
+  """
+  Render timings (texstats histograms), cache and pool counters as JSON.
+  """
+
+  def GET(self):
+    web.header('Content-Type', 'application/json')
+    web.header('Cache-Control', 'no-cache')
+    return json.dumps({'render':texstats.stats.snapshot(),
+      'cache':texcache.cache.stats(), 'flights':texcache.flights.stats(),
+      'pool':pool.stats()})
+
 
 def main():
   print "WebAxiom Test V 0.1"
   print "Press Ctrl-C or close this window to terminate the server\n"
   app = web.application(urls, globals())
-  app.run()
+  try:
+    app.run()
+  finally:
+    pool.stop()
 
 
 if __name__ == '__main__':